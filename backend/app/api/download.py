@@ -11,12 +11,9 @@ router = APIRouter(prefix="/api", tags=["download"])
 def download(slice_ids: Optional[str] = None):   # например ?slice_ids=1,2,3,45
     if slice_ids:
         ids = [int(x) for x in slice_ids.split(',')]
-        df = pd.read_sql(
-            "SELECT * FROM products WHERE id IN ({})".format(','.join('?' for _ in ids)),
-            storage.conn, params=ids
-        )
+        df = storage.get_products_df(ids)
     else:
-        df = pd.read_sql("SELECT * FROM products", storage.conn)
+        df = storage.get_all_products_df()
 
     # Добавляем читаемые колонки
     df['group_size'] = df.groupby('group_id')['id'].transform('count')
@@ -1,44 +1,144 @@
 # backend/app/api/groups.py
-from fastapi import APIRouter, Query, Request, Body, HTTPException
+from fastapi import APIRouter, Query, Request, Response, Body, HTTPException
 from app.services.storage import storage
-from app.services.grouping_core import aggregate_df
+from app.core.config import GROUP_PREVIEW_SIZE
+from app.services.engines import ENGINE_MODULES, get_engine, run_engine
+import numpy as np
 import pandas as pd
-from typing import Optional, List
+from pydantic import Field
+from typing import Annotated, Optional, List
 
 router = APIRouter(prefix="/api/groups", tags=["groups"])
 
+def _core():
+    """grouping_core (sklearn, scipy) импортируется при первом запросе группировки"""
+    return get_engine('tfidf')
+
+def _run_engine(engine: str, df: pd.DataFrame, strictness: float, **options):
+    if engine not in ENGINE_MODULES:
+        raise HTTPException(400, f"Unknown engine '{engine}', expected one of: {', '.join(ENGINE_MODULES)}")
+    return run_engine(engine, df, strictness, features=storage.ensure_signatures(df), **options)
+
 @router.post("/aggregate")
-async def aggregate():
+def aggregate(engine: str = 'tfidf', strictness: float = Query(0.7, ge=0, le=1)):
+    """Группировка всего каталога движком engine (tfidf, fingerprint, sbert, minilm)"""
     df = storage.get_all_products_df()
     if df.empty:
         return {"error": "no data"}
-    groups = aggregate_df(df)
-    storage.apply_groups(groups)
-    return {"status": "ok", "groups": len(groups)}
+    result = _run_engine(engine, df, strictness)
+    storage.apply_groups(result.positions, df['id'].tolist(), scores=result.scores)
+    return {"status": "ok", "groups": len(result.groups), "engine": engine, "metadata": result.metadata}
 
 @router.post("/reaggregate")
-def reaggregate(strictness: float = 0.7):
+def reaggregate(
+    # Вне [0, 1] eps больше TREE_MAX_EPS: иерархический режим резал бы усечённое дерево
+    strictness: float = Query(0.7, ge=0, le=1),
+    hierarchical: bool = False,
+    incremental: bool = False,
+    group_ids: Optional[List[str]] = Body(None, embed=True),   # для incremental: группы к пересборке
+):
+    if incremental:
+        return _reaggregate_incremental(strictness, hierarchical, group_ids or [])
     df = storage.get_all_products_df()
     if df.empty:
         return {"error": "no data"}
     # Если есть плохие оценки, разбиваем
-    bad_groups = [row[0] for row in storage.cursor.execute('SELECT group_id FROM groups WHERE user_score < 3').fetchall()]
+    bad_groups = storage.get_low_rated_group_ids()
     for gid in bad_groups:
         storage.delete_group(gid)
-    groups = aggregate_df(df, strictness=strictness)
-    storage.apply_groups(groups)
+    groups = _core().aggregate_df(df, strictness=strictness, hierarchical=hierarchical,
+                                  features=storage.ensure_signatures(df))
+    storage.apply_groups(groups, df['id'].tolist())
     return {"status": "ok", "strictness": strictness, "groups_created": len(groups)}
 
+def _block_products(grouper, targets: set) -> pd.DataFrame:
+    """Товары блоков (категорий после preprocess_text), где есть товары групп targets"""
+    categories = storage.get_category_names()
+    keys = set(grouper.preprocess_series(pd.Series(storage.get_category_names(sorted(targets)), dtype=object)))
+    block_keys = grouper.preprocess_series(pd.Series(categories, dtype=object))
+    return storage.get_category_products_df([c for c, key in zip(categories, block_keys) if key in keys])
+
+def _reaggregate_incremental(strictness: float, hierarchical: bool, group_ids: List[str]):
+    """Пересборка только плохо оценённых и выбранных групп вместе с соседями.
+
+    Соседи — товары того же блока в радиусе eps от пересобираемых; их
+    группы пересобираются целиком, кроме одобренных модератором
+    (user_score >= 3). Из БД читаются только блоки с затронутыми товарами,
+    остальные группы и их строки не меняются.
+    """
+    empty = {"status": "ok", "strictness": strictness, "products_reclustered": 0,
+             "groups_replaced": 0, "groups_created": 0}
+    targets = set(storage.get_low_rated_group_ids()) | set(group_ids)
+    if not targets:
+        return empty
+    grouper = _core().ProductGrouper(strictness, hierarchical=hierarchical)
+    df = _block_products(grouper, targets)
+    affected = df['group_id'].isin(targets).to_numpy()
+    if not affected.any():
+        return empty
+
+    features = storage.ensure_signatures(df)
+    near = grouper.neighbour_mask(features, affected)
+    replaced = (set(df.loc[near, 'group_id'].dropna()) - set(storage.get_protected_group_ids())) | targets
+    # Участники заменяемых групп вне блоков (перенесённые вручную) пересобираются вместе с ними
+    outside = storage.get_group_products_df(sorted(replaced))
+    outside = outside[~outside['id'].isin(df['id'])]
+    if not outside.empty:
+        df = pd.concat([df, outside], ignore_index=True)
+        features = pd.concat([features, storage.ensure_signatures(outside)], ignore_index=True)
+        near = np.concatenate([near, np.zeros(len(outside), dtype=bool)])
+    selected = (df['group_id'].isin(replaced) | (near & df['group_id'].isna())).to_numpy()
+
+    df_selected = df[selected].reset_index(drop=True)
+    groups = grouper.aggregate_df(df_selected, features=features[selected].reset_index(drop=True))
+    created = storage.replace_groups(sorted(replaced), groups, df_selected['id'].tolist())
+    return {"status": "ok", "strictness": strictness, "products_reclustered": len(df_selected),
+            "groups_replaced": len(replaced), "groups_created": len(created)}
+
 @router.get("")
 def list_groups(
     request: Request,
+    response: Response,
     query: Optional[str] = Query(None),
     category: Optional[str] = Query(None),
     offset: int = Query(0),
     limit: int = Query(20),
+    preview: int = Query(GROUP_PREVIEW_SIZE, ge=0),
+    after: Optional[str] = Query(None),
 ):
-    filters = {k: v for k, v in request.query_params.items() if k not in ['query', 'category', 'offset', 'limit']}
-    return storage.search_groups(query, category, filters, offset, limit)
+    """Страница групп. after — курсор последней группы (см. заголовок X-Next-Cursor);
+    offset оставлен для обратной совместимости и при after игнорируется."""
+    filters = {k: v for k, v in request.query_params.items() if k not in ['query', 'category', 'offset', 'limit', 'preview', 'after']}
+    try:
+        groups = storage.search_groups(query, category, filters, 0 if after else offset, limit,
+                                       preview_size=preview, after=after)
+    except ValueError as exc:
+        raise HTTPException(400, str(exc)) from exc
+    if len(groups) == limit:
+        response.headers["X-Next-Cursor"] = groups[-1]["cursor"]
+    return groups
+
+@router.get("/facets")
+def get_facets(
+    query: Optional[str] = Query(None),
+    category: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1),
+):
+    """Категории, производители и значения характеристик с количеством товаров"""
+    return storage.get_facets(query, category, limit)
+
+@router.post("/strictness-preview")
+def strictness_preview(
+    product_ids: Optional[List[int]] = Body(None, embed=True),   # срез; без него — весь каталог
+    values: List[Annotated[float, Field(ge=0, le=1)]] = Query([i / 10 for i in range(11)]),
+):
+    """Сколько групп получится при каждой строгости из values. В БД ничего не пишется:
+    деревья блоков строятся один раз (и кэшируются), каждое значение — только разрез."""
+    df = storage.get_products_df(product_ids) if product_ids else storage.get_all_products_df()
+    if df.empty:
+        return []
+    grouper = _core().ProductGrouper(hierarchical=True)
+    return grouper.strictness_preview(df, values, features=storage.ensure_signatures(df))
 
 @router.get("/{group_id}")
 def get_group(group_id: str):
@@ -57,40 +157,23 @@ def rate_group(group_id: str, score: int):
 @router.post("/reaggregate-slice")
 def reaggregate_slice(
     product_ids: List[int] = Body(..., embed=True),   # список id товаров из среза
-    strictness: float = 0.7
+    strictness: float = Query(0.7, ge=0, le=1),
+    hierarchical: bool = False,
+    engine: str = 'tfidf',    # для небольшого среза можно взять дорогой движок (sbert)
 ):
     """Переагрегировать только выбранный пул товаров (даже из разных групп)"""
-    df_slice = storage.cursor.execute(
-        "SELECT * FROM products WHERE id IN ({})".format(','.join('?' for _ in product_ids)),
-        product_ids
-    ).fetchall()
-    cols = [desc[0] for desc in storage.cursor.description]
-    df = pd.DataFrame(df_slice, columns=cols)
-
-    # Удаляем старые group_id у этих товаров
-    storage.cursor.execute(
-        "UPDATE products SET group_id = NULL WHERE id IN ({})".format(','.join('?' for _ in product_ids)),
-        product_ids
-    )
-    storage.conn.commit()
+    df = storage.get_products_df(product_ids)
 
     # Агрегируем только этот срез
-    groups = aggregate_df(df, strictness=strictness)
+    options = {'hierarchical': hierarchical} if engine == 'tfidf' else {}
+    result = _run_engine(engine, df, strictness, **options)
+
+    # Удаляем старые group_id у этих товаров
+    storage.ungroup_products(product_ids)
 
     # Применяем новые группы (только для этих товаров)
-    for gid, idxs in groups.items():
-        rep_id = df.iloc[idxs[0]]['id']
-        name = df.iloc[idxs[0]]['name']
-        storage.cursor.execute(
-            "INSERT OR REPLACE INTO groups (group_id, name, representative_id) VALUES (?, ?, ?)",
-            (gid, name, rep_id)
-        )
-        storage.cursor.executemany(
-            "UPDATE products SET group_id = ? WHERE id = ?",
-            [(gid, df.iloc[i]['id']) for i in idxs]
-        )
-    storage.conn.commit()
-    return {"status": "ok", "new_groups": len(groups)}
+    storage.apply_slice_groups(result.positions, df['id'].tolist(), scores=result.scores)
+    return {"status": "ok", "new_groups": len(result.groups), "engine": engine, "metadata": result.metadata}
 
 @router.post("/{group_id}/move")
 def move_product_to_group(
@@ -99,17 +182,8 @@ def move_product_to_group(
     target_group_id: str = Body(..., embed=True)
 ):
     """Переместить одну СТЕ в другую группу (ручная правка)"""
-    # Проверка существования
-    storage.cursor.execute("SELECT 1 FROM products WHERE id = ?", (product_id,))
-    if not storage.cursor.fetchone():
-        raise HTTPException(404, "Product not found")
-    storage.cursor.execute("SELECT 1 FROM groups WHERE group_id = ?", (target_group_id,))
-    if not storage.cursor.fetchone():
-        raise HTTPException(404, "Target group not found")
-
-    storage.cursor.execute(
-        "UPDATE products SET group_id = ? WHERE id = ?",
-        (target_group_id, product_id)
-    )
-    storage.conn.commit()
+    try:
+        storage.move_product_to_group(product_id, target_group_id)
+    except KeyError as exc:
+        raise HTTPException(404, exc.args[0]) from exc
     return {"status": "ok"}
\ No newline at end of file
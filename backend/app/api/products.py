@@ -27,7 +27,7 @@ class ProductUpdate(BaseModel):
     characteristics: Optional[Dict[str, str]] = None
 
 @router.post("")
-async def create_product(product_data: ProductCreate, target_group_id: Optional[str] = Query(default=None)):
+def create_product(product_data: ProductCreate, target_group_id: Optional[str] = Query(default=None)):
     """Создание нового товара"""
     try:
         # Преобразуем характеристики в строку
@@ -55,12 +55,11 @@ async def create_product(product_data: ProductCreate, target_group_id: Optional[
         raise HTTPException(status_code=500, detail=f"Error creating product: {str(e)}")
 
 @router.put("/{product_id}")
-async def update_product(product_id: int, product_data: ProductUpdate):
+def update_product(product_id: int, product_data: ProductUpdate):
     """Обновление товара"""
     try:
         # Получаем текущий продукт
-        storage.cursor.execute("SELECT * FROM products WHERE id = ?", (product_id,))
-        product = storage.cursor.fetchone()
+        product = storage.get_product(product_id)
         if not product:
             raise HTTPException(status_code=404, detail="Product not found")
         
@@ -92,7 +91,7 @@ async def update_product(product_id: int, product_data: ProductUpdate):
         raise HTTPException(status_code=500, detail=f"Error updating product: {str(e)}")
 
 @router.delete("/{product_id}")
-async def delete_product(product_id: int):
+def delete_product(product_id: int):
     """Удаление товара"""
     try:
         storage.delete_product(product_id)
@@ -101,26 +100,13 @@ async def delete_product(product_id: int):
         raise HTTPException(status_code=500, detail=f"Error deleting product: {str(e)}")
 
 @router.get("/{product_id}")
-async def get_product(product_id: int):
+def get_product(product_id: int):
     """Получение информации о товаре"""
     try:
-        storage.cursor.execute("SELECT * FROM products WHERE id = ?", (product_id,))
-        product = storage.cursor.fetchone()
-        if not product:
+        # Характеристики разбирает storage, результат кэшируется
+        product_dict = storage.get_product(product_id)
+        if not product_dict:
             raise HTTPException(status_code=404, detail="Product not found")
-        
-        columns = [desc[0] for desc in storage.cursor.description]
-        product_dict = dict(zip(columns, product))
-        
-        # Парсим характеристики
-        characteristics = {}
-        if product_dict.get('characteristics'):
-            for part in product_dict['characteristics'].split(';'):
-                if ':' in part:
-                    key, value = part.split(':', 1)
-                    characteristics[key.strip()] = value.strip()
-        
-        product_dict['characteristics_dict'] = characteristics
         return product_dict
         
     except HTTPException:
@@ -1,25 +1,118 @@
 # backend/app/api/upload.py
 from fastapi import APIRouter, File, UploadFile, HTTPException
 import pandas as pd
-import io
+import numpy as np
 import logging
+import re
+import shutil
+import time
+import uuid
+import zipfile
+from pathlib import Path
+from typing import Iterator
+from app.core.config import UPLOADED_DIR, UPLOAD_CHUNK_ROWS
 from app.services.preprocessor import preprocess_and_normalize
 from app.services.storage import storage
-from app.services.grouping_core import aggregate_df
+from app.services.engines import run_engine
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api", tags=["upload"])
 
+def _spool(file: UploadFile) -> Path:
+    """Копия загрузки в data/uploaded блоками по 1 МБ — файл целиком в памяти не держится"""
+    UPLOADED_DIR.mkdir(parents=True, exist_ok=True)
+    name = re.sub(r'[^\w.-]+', '_', Path(file.filename or 'upload.xlsx').name)
+    path = UPLOADED_DIR / f"{uuid.uuid4().hex[:8]}_{name}"
+    with open(path, 'wb') as out:
+        shutil.copyfileobj(file.file, out, 1 << 20)
+    return path
+
+def _open_workbook(path: Path):
+    # openpyxl импортируется при загрузке файла, а не при старте воркера
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+    try:
+        # read_only: листы читаются потоково, без построения всего дерева ячеек
+        return load_workbook(path, read_only=True, data_only=True)
+    except (InvalidFileException, zipfile.BadZipFile, KeyError) as e:
+        raise HTTPException(400, f"Ожидается файл .xlsx: {e}")
+
+def _iter_excel_chunks(workbook, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """Строки первого листа чанками по chunk_rows, с колонками как у pd.read_excel.
+
+    Индекс чанка продолжает нумерацию строк файла, поэтому номера строк в
+    предупреждениях preprocess_and_normalize — сквозные.
+    """
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c) if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+        offset = 0
+        chunk = []
+        for row in rows:
+            # Пустые строки pd.read_excel тоже пропускает
+            if all(value is None for value in row):
+                continue
+            row = row[:len(columns)] + (None,) * (len(columns) - len(row))
+            # Значения — строки: 5 остаётся "5" и в чанке с пустыми ячейками колонки (без приведения к float)
+            chunk.append(tuple(np.nan if value is None else str(value) for value in row))
+            if len(chunk) == chunk_rows:
+                yield _chunk_frame(chunk, columns, offset)
+                offset += len(chunk)
+                chunk = []
+        if chunk:
+            yield _chunk_frame(chunk, columns, offset)
+    finally:
+        workbook.close()
+
+def _chunk_frame(rows: list, columns: list, offset: int) -> pd.DataFrame:
+    # Все колонки object в каждом чанке: хеши строк для поиска дублей и записанные
+    # в БД значения не зависят от того, на какие чанки пришёлся файл
+    return pd.DataFrame(rows, columns=columns, index=pd.RangeIndex(offset, offset + len(rows)), dtype=object)
+
 @router.post("/upload")
-async def upload(file: UploadFile = File(...)):
-    content = await file.read()
-    if not content:
-        raise HTTPException(400, "Файл пустой")
-    df = pd.read_excel(io.BytesIO(content))
-    df_processed, warnings = preprocess_and_normalize(df.copy())
-    storage.add_products(df_processed)
-    groups = aggregate_df(df_processed)
-    storage.apply_groups(groups)
-    return {"status": "ok", "loaded": len(df_processed), "warnings": warnings}
\ No newline at end of file
+def upload(file: UploadFile = File(...)):
+    """Потоковая загрузка каталога: файл спулится на диск, читается и пишется в БД чанками.
+
+    Память ограничена размером чанка (UPLOAD_CHUNK_ROWS), а не файла; группировка
+    идёт после загрузки по товарам из БД (кэш сигнатур, как у /api/groups/aggregate).
+    """
+    path = _spool(file)
+    try:
+        if path.stat().st_size == 0:
+            raise HTTPException(400, "Файл пустой")
+        total, loaded, warnings = _ingest(_open_workbook(path))
+    finally:
+        path.unlink(missing_ok=True)
+
+    df = storage.get_all_products_df()
+    if not df.empty:
+        result = run_engine('tfidf', df, features=storage.ensure_signatures(df))
+        storage.apply_groups(result.positions, df['id'].tolist(), scores=result.scores)
+    return {"status": "ok", "loaded": loaded, "warnings": warnings}
+
+def _ingest(workbook):
+    """Чанки листа -> preprocess_and_normalize -> add_products; возвращает (строк в файле, загружено, предупреждения).
+
+    Каталог заменяется атомарно: при ошибке на любом чанке остаётся прежний.
+    """
+    warnings = []
+    total = loaded = 0
+    started = time.perf_counter()
+    with storage.catalog_replacement():
+        for chunk in _iter_excel_chunks(workbook, UPLOAD_CHUNK_ROWS):
+            total += len(chunk)
+            # Полные дубли удаляются по всему файлу: хеши строк прежних чанков хранятся в БД
+            fresh = storage.new_upload_rows(pd.util.hash_pandas_object(chunk, index=False).to_numpy())
+            chunk_processed, chunk_warnings = preprocess_and_normalize(chunk[fresh], summary=False)
+            warnings.extend(w for w in chunk_warnings if w not in warnings)
+            if chunk_processed.empty:
+                continue
+            loaded += len(storage.add_products(chunk_processed, replace=False))
+    warnings.append(f"Обработано: {total} → {loaded} строк (-{total - loaded})")
+    logger.info(f"Ingested {total} rows in {time.perf_counter() - started:.2f}s")
+    return total, loaded, warnings
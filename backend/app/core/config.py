@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 from pathlib import Path
+from typing import Optional, Tuple
 
 # Project directories
 BASE_DIR: Path = Path(__file__).resolve().parents[2]
@@ -14,3 +15,43 @@ def ensure_dirs() -> None:
     """Ensure required directories exist for runtime operations."""
     for directory in (DATA_DIR, UPLOADED_DIR, TEMP_DIR):
         directory.mkdir(parents=True, exist_ok=True)
+
+# SQLite connection pool
+DB_POOL_SIZE: int = 8
+DB_BUSY_TIMEOUT: float = 30.0
+
+# Сколько товаров группы отдавать в превью списка групп
+GROUP_PREVIEW_SIZE: int = 100
+
+# Read-through LRU-кэш карточек групп и товаров
+CACHE_SIZE: int = 2048
+CACHE_TTL: float = 60.0
+
+# Группировка: блоки по категории кластеризуются параллельно в процессах
+GROUPING_MAX_BLOCK_SIZE: int = 20000         # блоки крупнее дробятся дополнительным ключом
+GROUPING_WORKERS: Optional[int] = None       # None — по числу ядер
+GROUPING_PARALLEL_MIN_ROWS: int = 5000       # меньше — кластеризуем в текущем процессе
+GROUPING_VERIFY_WORKERS: int = -1            # потоки rapidfuzz cdist при проверке кластеров (-1 — все ядра)
+GROUPING_MIN_MEMBER_SIMILARITY: Optional[float] = None  # например 0.5: слабые участники отделяются (около 3x дольше; None — без проверки)
+GROUPING_VERIFY_SAMPLE_SIZE: int = 32        # крупный кластер проверяется по выборке участников
+
+# Дисковый кэш TF-IDF блоков: переиспользуется при смене strictness
+TFIDF_CACHE_DIR: Path = TEMP_DIR / "tfidf"
+TFIDF_CACHE_MIN_ROWS: int = 200            # мелкие блоки дешевле векторизовать заново
+TFIDF_CACHE_MAX_ENTRIES: int = 2000        # сверх этого удаляются давно не использованные
+
+# Хранилище эмбеддингов sentence-transformer: вектор по хешу сигнатуры, memmap .npy
+EMBEDDING_STORE_DIR: Path = DATA_DIR / "embeddings"
+EMBEDDING_DTYPE: str = "float32"           # float16 вдвое экономит диск и page cache
+
+# Движки группировки, которые прогреваются в фоне после старта (engines.prewarm).
+# 'sbert' и 'minilm' при прогреве загружают модель (сотни МБ)
+PREWARM_ENGINES: Tuple[str, ...] = ('tfidf',)
+
+# ANN-индекс центроидов групп для привязки новых товаров (group_index, рядом с catalog.db)
+GROUP_INDEX_DIM: int = 512                 # размерность hashing-векторов 3-грамм
+GROUP_INDEX_NPROBE: int = 8                # сколько списков IVF просматривает поиск
+GROUP_INDEX_THRESHOLD: float = 0.8         # минимальный косинус с центроидом для привязки
+
+# Потоковая загрузка Excel: строк в чанке (память ограничена чанком, а не файлом)
+UPLOAD_CHUNK_ROWS: int = 10000
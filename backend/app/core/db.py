@@ -0,0 +1,98 @@
+"""Thread-safe SQLite connection pool used by the storage layer."""
+from __future__ import annotations
+
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List
+
+# PRAGMA применяются к каждому новому соединению пула
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -65536",      # 64 МБ страничного кэша на соединение
+    "PRAGMA mmap_size = 268435456",    # 256 МБ memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections in WAL mode.
+
+    Each connection is handed to exactly one thread at a time, so cursors are
+    never shared between concurrent requests. Connections work in autocommit
+    mode; write paths open explicit transactions via :meth:`transaction`.
+    """
+
+    def __init__(self, db_path: Path, size: int = 8, busy_timeout: float = 30.0) -> None:
+        self.db_path = Path(db_path)
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._all: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}")
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._all) < self.size:
+                conn = self._connect()
+                self._all.append(conn)
+                return conn
+        # Пул исчерпан — ждём, пока другой поток вернёт соединение
+        return self._idle.get(timeout=self.busy_timeout)
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection for the duration of the block."""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection and run the block in a write transaction.
+
+        ``BEGIN IMMEDIATE`` takes the write lock up front, so concurrent
+        writers wait on ``busy_timeout`` instead of failing mid-transaction.
+        """
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    def close(self) -> None:
+        """Close every connection owned by the pool."""
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all.clear()
+            self._idle = queue.LifoQueue()
@@ -0,0 +1,232 @@
+"""Versioned schema migrations for catalog.db."""
+from __future__ import annotations
+
+import logging
+import sqlite3
+from typing import Callable, List, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Шаг миграции: SQL-строка или функция, получающая соединение
+Step = Union[str, Callable[[sqlite3.Connection], None]]
+
+
+def _fts_columns(alias: str) -> str:
+    """Колонки товара для FTS-индекса с заменой ё -> е.
+
+    unicode61 снимает диакритику только с латиницы, поэтому ё сворачиваем
+    сами; запрос нормализуется так же (storage._fts_query).
+    """
+    return ", ".join(
+        f"replace(replace({alias}.{col}, 'ё', 'е'), 'Ё', 'Е')"
+        for col in ("name", "model", "manufacturer", "characteristics")
+    )
+
+def product_facets_sql(condition: str = "1") -> str:
+    """SELECT значений фасетов сгруппированных товаров products p, для которых верно condition.
+
+    Условие подставляется в каждую ветку UNION ALL (в view SQLite его не
+    проталкивает), поэтому параметры condition передаются трижды.
+    """
+    return f'''
+    SELECT COALESCE(p.category_name, '') AS category_name, 'category_name' AS facet,
+           '' AS key, COALESCE(p.category_name, '') AS value
+    FROM products p WHERE p.group_id IS NOT NULL AND {condition}
+    UNION ALL
+    SELECT COALESCE(p.category_name, ''), 'manufacturer', '', COALESCE(p.manufacturer, '')
+    FROM products p WHERE p.group_id IS NOT NULL AND {condition}
+    UNION ALL
+    SELECT COALESCE(p.category_name, ''), 'attribute', a.key, COALESCE(a.value, '')
+    FROM product_attributes a JOIN products p ON p.id = a.product_id
+    WHERE p.group_id IS NOT NULL AND {condition}'''
+
+
+# Полный пересчёт facet_counts (сам DELETE выполняет вызывающий код)
+REBUILD_FACETS_SQL = f'''
+INSERT INTO facet_counts (category_name, facet, key, value, product_count)
+SELECT category_name, facet, key, value, COUNT(*) FROM ({product_facets_sql()})
+GROUP BY category_name, facet, key, value'''
+
+
+def _backfill_product_attributes(conn: sqlite3.Connection) -> None:
+    # Импорт здесь: preprocessor тянет pandas, а миграции 1-3 его не требуют
+    from app.services.preprocessor import attribute_rows
+
+    for product_id, raw in conn.execute("SELECT id, characteristics FROM products").fetchall():
+        conn.executemany(
+            "INSERT INTO product_attributes (product_id, key, value, numeric_value) VALUES (?, ?, ?, ?)",
+            attribute_rows(product_id, raw),
+        )
+
+
+MIGRATIONS: List[Tuple[int, str, Sequence[Step]]] = [
+    (1, "base schema", (
+        '''
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            original_id TEXT,
+            name TEXT,
+            model TEXT,
+            manufacturer TEXT,
+            country TEXT,
+            category_id TEXT,
+            category_name TEXT,
+            image_url TEXT,
+            characteristics TEXT,
+            group_id TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        '''
+        CREATE TABLE IF NOT EXISTS groups (
+            group_id TEXT PRIMARY KEY,
+            name TEXT,
+            representative_id INTEGER,
+            product_count INTEGER DEFAULT 0,
+            score REAL DEFAULT 0.0,
+            user_score INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (representative_id) REFERENCES products (id)
+        )''',
+        '''
+        CREATE TABLE IF NOT EXISTS group_attributes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id TEXT,
+            attribute_name TEXT,
+            attribute_value TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (group_id) REFERENCES groups (group_id)
+        )''',
+    )),
+    (2, "secondary indexes", (
+        # id во вторых колонках делает индексы покрывающими для выборок по группе
+        "CREATE INDEX IF NOT EXISTS idx_products_group_id ON products (group_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_products_category_name ON products (category_name, group_id)",
+        "CREATE INDEX IF NOT EXISTS idx_products_manufacturer ON products (manufacturer, group_id)",
+        "CREATE INDEX IF NOT EXISTS idx_group_attributes_group_id "
+        "ON group_attributes (group_id, attribute_name, attribute_value)",
+        "CREATE INDEX IF NOT EXISTS idx_groups_product_count ON groups (product_count DESC, group_id)",
+    )),
+    (3, "full-text index over products", (
+        # external content: текст хранится только в products, FTS держит индекс
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, model, manufacturer, characteristics,
+            content='products', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, name, model, manufacturer, characteristics)
+            VALUES (new.id, {_fts_columns("new")});
+        END''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, model, manufacturer, characteristics)
+            VALUES ('delete', old.id, {_fts_columns("old")});
+        END''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS products_fts_au
+        AFTER UPDATE OF name, model, manufacturer, characteristics ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, model, manufacturer, characteristics)
+            VALUES ('delete', old.id, {_fts_columns("old")});
+            INSERT INTO products_fts (rowid, name, model, manufacturer, characteristics)
+            VALUES (new.id, {_fts_columns("new")});
+        END''',
+        # Индексируем уже загруженные товары
+        f'''
+        INSERT INTO products_fts (rowid, name, model, manufacturer, characteristics)
+        SELECT id, {_fts_columns("products")} FROM products''',
+    )),
+    (4, "normalized product attributes", (
+        '''
+        CREATE TABLE IF NOT EXISTS product_attributes (
+            product_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT,
+            numeric_value REAL,
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        )''',
+        "CREATE INDEX IF NOT EXISTS idx_product_attributes_value ON product_attributes (key, value, product_id)",
+        "CREATE INDEX IF NOT EXISTS idx_product_attributes_numeric "
+        "ON product_attributes (key, numeric_value, product_id)",
+        "CREATE INDEX IF NOT EXISTS idx_product_attributes_product ON product_attributes (product_id)",
+        '''
+        CREATE TRIGGER IF NOT EXISTS product_attributes_ad AFTER DELETE ON products BEGIN
+            DELETE FROM product_attributes WHERE product_id = old.id;
+        END''',
+        _backfill_product_attributes,
+    )),
+    (5, "materialized facet counts", (
+        '''
+        CREATE TABLE IF NOT EXISTS facet_counts (
+            category_name TEXT NOT NULL,
+            facet TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            product_count INTEGER NOT NULL,
+            PRIMARY KEY (category_name, facet, key, value)
+        ) WITHOUT ROWID''',
+        # Частичный индекс: чистка обнулившихся значений не сканирует таблицу
+        "CREATE INDEX IF NOT EXISTS idx_facet_counts_empty ON facet_counts (product_count) WHERE product_count <= 0",
+        REBUILD_FACETS_SQL,
+    )),
+    (6, "cached product signatures", (
+        # Признаки и сигнатура группировки; content_hash — хеш исходных полей товара
+        '''
+        CREATE TABLE IF NOT EXISTS product_signatures (
+            product_id INTEGER PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            name TEXT,
+            model TEXT,
+            manufacturer TEXT,
+            category TEXT,
+            signature TEXT,
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        )''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS product_signatures_ad AFTER DELETE ON products BEGIN
+            DELETE FROM product_signatures WHERE product_id = old.id;
+        END''',
+    )),
+    (7, "moderator score index", (
+        # Оценку ставят немногим группам: частичный индекс покрывает выборки user_score < / >=
+        "CREATE INDEX IF NOT EXISTS idx_groups_user_score ON groups (user_score) WHERE user_score IS NOT NULL",
+    )),
+    (8, "upload row hashes", (
+        # Хеши строк файла текущей загрузки: полные дубли ищутся в БД, а не в памяти процесса
+        "CREATE TABLE IF NOT EXISTS upload_row_hashes (hash INTEGER PRIMARY KEY)",
+    )),
+]
+
+def current_version(conn: sqlite3.Connection) -> int:
+    """Return the applied schema version (0 for an empty database)."""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, name TEXT, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    )
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Apply pending migrations, each in its own transaction; return the new version."""
+    version = current_version(conn)
+    for number, name, steps in MIGRATIONS:
+        if number <= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (number, name))
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        version = number
+        logger.info(f"Applied migration {number}: {name}")
+    return version
@@ -6,7 +6,9 @@ from app.api.groups import router as groups_router
 from app.api.upload import router as upload_router
 from app.api.download import router as download_router
 from app.api.products import router as products_router  # Если есть
-from app.core.config import ensure_dirs
+from app.core.config import ensure_dirs, PREWARM_ENGINES
+from app.services.engines import prewarm
+from app.services.storage import storage
 
 app = FastAPI(title="TenderHack Backend", version="0.1.0")
 
@@ -22,6 +24,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.include_router(upload_router)
@@ -32,7 +35,16 @@ app.include_router(products_router)  # Если используется
 @app.on_event("startup")
 def _on_startup() -> None:
     ensure_dirs()
+    prewarm(PREWARM_ENGINES)
+
+@app.on_event("shutdown")
+def _on_shutdown() -> None:
+    storage.pool.close()
 
 @app.get("/health")
 def health() -> dict:
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+@app.get("/health/cache")
+def cache_stats() -> dict:
+    return {"groups": storage.group_cache.stats(), "products": storage.product_cache.stats()}
\ No newline at end of file
@@ -0,0 +1,137 @@
+# backend/app/services/embedding_store.py
+import hashlib
+import json
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+
+# sha1 сигнатуры — ключ строки в хранилище
+KEY_SIZE = 20
+_INITIAL_CAPACITY = 1024
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.sha1(text.encode('utf-8')).digest()
+
+
+class EmbeddingStore:
+    """Контентно-адресуемое хранилище эмбеддингов на диске.
+
+    vectors.npy — матрица (capacity × dim), открытая через numpy.memmap;
+    keys.bin — sha1 сигнатур подряд, i-й ключ соответствует i-й строке
+    матрицы. Вектор пишется раньше ключа, поэтому оборванная запись
+    оставляет лишь неиспользуемую строку. При переполнении файл
+    пересоздаётся с удвоенной ёмкостью.
+    """
+
+    def __init__(self, directory: Path, dim: int, dtype: str = 'float32'):
+        self.directory = Path(directory)
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.vectors_path = self.directory / 'vectors.npy'
+        self.keys_path = self.directory / 'keys.bin'
+        self.meta_path = self.directory / 'meta.json'
+        self._lock = threading.Lock()
+        self._open()
+
+    @classmethod
+    def for_model(cls, root: Path, model_name: str, dim: int, dtype: str = 'float32') -> "EmbeddingStore":
+        """Отдельный каталог на модель: векторы разных моделей несовместимы"""
+        return cls(Path(root) / re.sub(r'[^\w.-]+', '_', model_name), dim, dtype)
+
+    def _open(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        meta = {'dim': self.dim, 'dtype': self.dtype.str}
+        if self.meta_path.exists() and json.loads(self.meta_path.read_text()) != meta:
+            # Сменилась размерность или тип — старые векторы непригодны
+            for path in (self.vectors_path, self.keys_path):
+                path.unlink(missing_ok=True)
+        self.meta_path.write_text(json.dumps(meta))
+
+        keys = self.keys_path.read_bytes() if self.keys_path.exists() else b''
+        count = len(keys) // KEY_SIZE
+        self.index: Dict[bytes, int] = {keys[i * KEY_SIZE:(i + 1) * KEY_SIZE]: i for i in range(count)}
+        if not self.vectors_path.exists():
+            self._allocate(max(_INITIAL_CAPACITY, count))
+        self._matrix = np.lib.format.open_memmap(self.vectors_path, mode='r+')
+        if len(self._matrix) < count:
+            # keys.bin длиннее матрицы (файл подменили) — начинаем заново
+            self.index = {}
+            self.keys_path.unlink(missing_ok=True)
+
+    def _allocate(self, capacity: int, source: np.ndarray = None):
+        tmp = self.vectors_path.with_suffix('.tmp.npy')
+        matrix = np.lib.format.open_memmap(tmp, mode='w+', dtype=self.dtype, shape=(capacity, self.dim))
+        if source is not None:
+            matrix[:len(source)] = source
+        matrix.flush()
+        del matrix
+        os.replace(tmp, self.vectors_path)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """Заполненная часть матрицы — срез memmap без копирования"""
+        return self._matrix[:len(self.index)]
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        """Векторы строк rows; подряд идущие строки отдаются срезом memmap без копии"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) and rows[-1] - rows[0] == len(rows) - 1 and (np.diff(rows) == 1).all():
+            return self._matrix[rows[0]:rows[-1] + 1]
+        return self._matrix[rows]
+
+    def rows(self, texts: Sequence[str]) -> np.ndarray:
+        """Номера строк для текстов (-1 — вектора нет)"""
+        return np.fromiter((self.index.get(text_key(t), -1) for t in texts), dtype=np.int64, count=len(texts))
+
+    def add(self, texts: Sequence[str], embeddings: np.ndarray) -> np.ndarray:
+        """Дописать векторы новых текстов, вернуть номера их строк"""
+        with self._lock:
+            result = np.empty(len(texts), dtype=np.int64)
+            pending: Dict[bytes, int] = {}
+            new_rows: List[int] = []
+            count = len(self.index)
+            for i, text in enumerate(texts):
+                key = text_key(text)
+                row = self.index.get(key, pending.get(key))
+                if row is None:
+                    row = pending[key] = count + len(pending)
+                    new_rows.append(i)
+                result[i] = row
+            if not pending:
+                return result
+
+            needed = count + len(pending)
+            if needed > len(self._matrix):
+                capacity = len(self._matrix)
+                while capacity < needed:
+                    capacity *= 2
+                # Старый memmap остаётся валидным для читателей и после os.replace
+                self._allocate(capacity, self._matrix[:count])
+                self._matrix = np.lib.format.open_memmap(self.vectors_path, mode='r+')
+            self._matrix[count:needed] = np.asarray(embeddings)[new_rows]
+            self._matrix.flush()
+            with open(self.keys_path, 'ab') as f:
+                f.write(b''.join(pending))
+            # Индекс обновляется последним: читатели не увидят незаписанную строку
+            self.index.update(pending)
+            return result
+
+    def embed(self, texts: Sequence[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Номера строк для texts; encode вызывается только для текстов, которых ещё нет"""
+        rows = self.rows(texts)
+        missing = np.flatnonzero(rows < 0)
+        if len(missing):
+            # Повторы внутри пакета кодируем один раз
+            pending = list(dict.fromkeys(texts[i] for i in missing))
+            added = self.add(pending, encode(pending))
+            positions = dict(zip(pending, added))
+            rows[missing] = [positions[texts[i]] for i in missing]
+        return rows
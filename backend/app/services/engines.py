@@ -0,0 +1,223 @@
+# backend/app/services/engines.py
+"""Ленивый реестр движков группировки и моделей sentence-transformers.
+
+Модули движков импортируются при первом обращении, модели загружаются при
+первом использовании — старт воркера не тянет sklearn, scipy и torch.
+prewarm прогревает выбранные движки в фоновом потоке после старта.
+
+run_engine — единый интерфейс: любой движок получает товары из БД
+(storage.get_*_df) и возвращает EngineResult с id товаров, оценками групп
+и временем работы.
+"""
+import importlib
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Имя движка → модуль реализации; импортируется только get_engine.
+# grouping_core_backup_1 не зарегистрирован: он не импортируется без category_*.json
+ENGINE_MODULES: Dict[str, str] = {
+    'tfidf': 'app.services.grouping_core',
+    'fingerprint': 'app.services.grouping_core',
+    'sbert': 'app.services.grouping_v2',
+    'minilm': 'app.services.grouping_core_ALL_MINI',
+}
+
+_models: Dict[str, object] = {}
+_models_lock = threading.Lock()
+
+
+def get_engine(name: str) -> ModuleType:
+    """Модуль движка name (импортируется при первом вызове)"""
+    if name not in ENGINE_MODULES:
+        raise ValueError(f"Unknown grouping engine: {name}")
+    return importlib.import_module(ENGINE_MODULES[name])
+
+
+def get_model(name: str):
+    """SentenceTransformer name, загружается один раз на процесс"""
+    with _models_lock:
+        model = _models.get(name)
+        if model is None:
+            started = time.perf_counter()
+            from sentence_transformers import SentenceTransformer
+            model = _models[name] = SentenceTransformer(name)
+            logger.info(f"Loaded model {name} in {time.perf_counter() - started:.1f}s")
+        return model
+
+
+def _warm(names: Iterable[str]):
+    for name in names:
+        started = time.perf_counter()
+        try:
+            engine = get_engine(name)
+            warmup = getattr(engine, 'warmup', None)
+            if warmup is not None:
+                warmup()
+        except Exception as e:
+            logger.warning(f"Prewarm of engine {name} failed: {e}")
+            continue
+        logger.info(f"Engine {name} warmed up in {time.perf_counter() - started:.1f}s")
+
+
+def prewarm(names: Iterable[str]) -> threading.Thread:
+    """Прогрев движков в фоновом потоке; запросы к ещё не прогретому движку просто ждут импорта"""
+    thread = threading.Thread(target=_warm, args=(list(names),), name='engine-prewarm', daemon=True)
+    thread.start()
+    return thread
+
+
+@dataclass
+class EngineResult:
+    """Результат движка в едином виде.
+
+    groups — id группы → id товаров, positions — те же группы позициями
+    исходного DataFrame (для storage.apply_groups), scores — оценка группы
+    0-100: средняя схожесть участников с представителем по сигнатурам
+    grouping_core, одинаковая для всех движков.
+    """
+    engine: str
+    groups: Dict[str, List[int]]
+    scores: Dict[str, float]
+    metadata: Dict[str, Any]
+    positions: Dict[str, List[int]] = field(repr=False, default_factory=dict)
+
+
+# Имя движка → функция (модуль, товары, strictness, признаки, **опции) -> группы позиций
+_RUNNERS: Dict[str, Callable[..., Dict[str, List[int]]]] = {}
+
+
+def register_runner(name: str):
+    def decorator(func):
+        _RUNNERS[name] = func
+        return func
+    return decorator
+
+
+def _source_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Товары из БД с колонками исходного файла — в таком виде их ждут sbert и minilm"""
+    from app.services.storage import PRODUCT_SOURCE_COLUMNS
+    from app.services.preprocessor import parse_characteristics
+
+    db_columns = ('original_id', 'name', 'model', 'manufacturer', 'country',
+                  'category_id', 'category_name', 'image_url', 'characteristics')
+    source = df[list(db_columns)].rename(columns=dict(zip(db_columns, PRODUCT_SOURCE_COLUMNS)))
+    source = source.reset_index(drop=True)
+    source['internal_id'] = df['id'].to_numpy()
+    source['characteristics_raw'] = source['характеристики']
+    source['characteristics_norm'] = source['характеристики'].apply(parse_characteristics)
+    return source
+
+
+@register_runner('tfidf')
+def _run_tfidf(module, df, strictness, features, **options):
+    # options — параметры grouping_core.aggregate_df (hierarchical, use_minhash, ...)
+    return module.aggregate_df(df, strictness=strictness, features=features, **options)
+
+
+@register_runner('fingerprint')
+def _run_fingerprint(module, df, strictness, features, **options):
+    # Только точные совпадения нормализованной сигнатуры: strictness не влияет
+    signatures = features['signature'].tolist()
+    unique_signatures, inverse, _ = module.fingerprint_signatures(signatures)
+    groups: Dict[str, List[int]] = {}
+    members: Dict[int, List[int]] = {}
+    for position, code in enumerate(inverse.tolist()):
+        members.setdefault(code, []).append(position)
+    for code, positions in members.items():
+        if len(positions) >= 2 and unique_signatures[code]:
+            groups[f"fp_{len(groups)}"] = positions
+    return groups
+
+
+@register_runner('sbert')
+def _run_sbert(module, df, strictness, features, **options):
+    # Товары в БД уже прошли preprocess_and_normalize при загрузке
+    return module.aggregate_df(_source_frame(df), strictness=strictness, preprocess=False)
+
+
+@register_runner('minilm')
+def _run_minilm(module, df, strictness, features, **options):
+    position_of = {int(product_id): i for i, product_id in enumerate(df['id'].tolist())}
+    return {
+        group['id']: [position_of[int(product_id)] for product_id in group['product_ids']]
+        for group in module.aggregate_df(_source_frame(df), strictness=strictness)
+    }
+
+
+def _group_scores(groups: Dict[str, List[int]], signatures: List[str]) -> Dict[str, float]:
+    from app.services.grouping_core import ProductGrouper
+
+    # Пары (представитель, участник) всех групп сравниваются одним пакетом:
+    # вызов cdist на каждую группу стоил больше самих сравнений
+    scores = {}
+    scored, queries, choices, sizes = [], [], [], []
+    for gid, positions in groups.items():
+        if len(positions) < 2:
+            scores[gid] = 100.0
+            continue
+        scored.append(gid)
+        queries.extend([signatures[positions[0]]] * (len(positions) - 1))
+        choices.extend(signatures[i] for i in positions[1:])
+        sizes.append(len(positions) - 1)
+    if scored:
+        similarity = ProductGrouper().pair_similarity(queries, choices)
+        starts = np.cumsum([0] + sizes[:-1])
+        means = np.add.reduceat(similarity, starts) / np.asarray(sizes, dtype=np.float32)
+        for gid, mean in zip(scored, means.tolist()):
+            scores[gid] = round(mean * 100, 2)
+    return scores
+
+
+def run_engine(name: str, df: pd.DataFrame, strictness: float = 0.7,
+               features: Optional[pd.DataFrame] = None, **options) -> EngineResult:
+    """Группировка товаров df (результат storage.get_*_df) движком name.
+
+    features — признаки по позициям df (storage.ensure_signatures); без них
+    строятся заново. options понимает только tfidf, остальные их игнорируют. Товары, не попавшие ни в одну группу, становятся
+    одиночными группами single_N, как у tfidf.
+    """
+    module = get_engine(name)
+    if features is None:
+        from app.services.grouping_core import ProductGrouper
+        features = ProductGrouper().build_signatures(df)
+
+    started = time.perf_counter()
+    positions = {gid: list(items) for gid, items in _RUNNERS[name](module, df, strictness, features, **options).items() if items}
+    grouping_seconds = time.perf_counter() - started
+
+    covered = {i for items in positions.values() for i in items}
+    n = 0
+    for i in range(len(df)):
+        if i in covered:
+            continue
+        while f"single_{n}" in positions:
+            n += 1
+        positions[f"single_{n}"] = [i]
+    multi = sum(1 for items in positions.values() if len(items) > 1)
+    singles = len(positions) - multi
+
+    started = time.perf_counter()
+    scores = _group_scores(positions, features['signature'].tolist())
+    scoring_seconds = time.perf_counter() - started
+
+    product_ids = df['id'].tolist()
+    groups = {gid: [int(product_ids[i]) for i in items] for gid, items in positions.items()}
+    metadata = {
+        'products': len(df),
+        'groups': multi,
+        'singles': singles,
+        'strictness': strictness,
+        'grouping_seconds': round(grouping_seconds, 3),
+        'scoring_seconds': round(scoring_seconds, 3),
+    }
+    logger.info(f"Engine {name}: {multi} groups, {singles} singles in {grouping_seconds:.2f}s")
+    return EngineResult(engine=name, groups=groups, scores=scores, metadata=metadata, positions=positions)
@@ -0,0 +1,280 @@
+# backend/app/services/group_index.py
+import json
+import os
+import re
+import threading
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.minhash import shingles
+
+_non_word_run_re = re.compile(r'\W+')
+
+
+def product_text(name, model, manufacturer) -> str:
+    """Текст товара для индекса: название, модель и производитель без пунктуации"""
+    parts = (str(value) for value in (name, model, manufacturer) if value)
+    return _non_word_run_re.sub(' ', ' '.join(parts).lower()).strip()
+
+
+def text_vectors(texts: Sequence[str], dim: int) -> np.ndarray:
+    """Нормированные hashing-векторы символьных 3-грамм (знак — по старшему биту crc32)"""
+    result = np.zeros((len(texts), dim), dtype=np.float32)
+    cache: Dict[str, int] = {}
+    for i, text in enumerate(texts):
+        if text in cache:
+            result[i] = result[cache[text]]
+            continue
+        cache[text] = i
+        items = shingles(f' {text} ')
+        if not items:
+            continue
+        # crc32 стабилен между процессами, в отличие от hash()
+        h = np.fromiter((zlib.crc32(s.encode()) for s in items), dtype=np.uint32, count=len(items))
+        np.add.at(result[i], h % dim, np.where(h >> 31, -1.0, 1.0).astype(np.float32))
+        norm = np.linalg.norm(result[i])
+        if norm:
+            result[i] /= norm
+    return result
+
+
+def _spherical_kmeans(vectors: np.ndarray, k: int, iterations: int = 8, seed: int = 0) -> np.ndarray:
+    rng = np.random.RandomState(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        norms = np.linalg.norm(sums, axis=1)
+        # Пустой кластер сохраняет прежний центр
+        filled = norms > 0
+        centroids[filled] = sums[filled] / norms[filled, None]
+    return centroids
+
+
+class GroupIndex:
+    """IVF-flat индекс центроидов групп для привязки новых товаров.
+
+    Каждой группе соответствует вектор — сумма векторов участников, скалярное
+    произведение на запрос делится на его норму (косинус с центроидом).
+    Группа без участников (counts) из поиска исключается.
+    Грубый квантизатор — spherical k-means на ~sqrt(n) списков; списки
+    разбиты по категориям, и поиск просматривает в nprobe ближайших списках
+    только группы категории запроса.
+    Изменения (add, subtract, remove) пишутся в журнал log.jsonl и
+    переигрываются при загрузке, поэтому индекс на диске обновляется без
+    перезаписи целиком.
+    """
+
+    def __init__(self, dim: int, nprobe: int = 8):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.quantizer = np.zeros((0, dim), dtype=np.float32)
+        self.sums = np.zeros((0, dim), dtype=np.float32)
+        self.norms = np.zeros(0, dtype=np.float32)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.group_ids: List[str] = []
+        self.categories: List[str] = []
+        self.position: Dict[str, int] = {}
+        # Номер списка IVF каждой группы и группы по (список, категория)
+        self.assign: List[int] = []
+        self.buckets: Dict[Tuple[int, str], List[int]] = {}
+        self.log_path: Optional[Path] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.group_ids)
+
+    @classmethod
+    def build(cls, texts: Sequence[str], group_ids: Sequence[str], categories: Sequence[str],
+              dim: int, nprobe: int = 8) -> "GroupIndex":
+        """Индекс по товарам: texts, group_ids и categories выровнены по товарам"""
+        index = cls(dim, nprobe)
+        if not len(texts):
+            return index
+        codes, inverse = np.unique(np.asarray(group_ids, dtype=str), return_inverse=True)
+        sums = np.zeros((len(codes), dim), dtype=np.float32)
+        np.add.at(sums, inverse, text_vectors(texts, dim))
+        # Категория группы — категория её первого товара
+        first = np.zeros(len(codes), dtype=np.int64)
+        first[inverse[::-1]] = np.arange(len(inverse))[::-1]
+
+        index.sums = sums
+        index.norms = np.linalg.norm(sums, axis=1).astype(np.float32)
+        index.counts = np.bincount(inverse, minlength=len(codes)).astype(np.int64)
+        index.group_ids = codes.tolist()
+        index.categories = [str(categories[i] or '') for i in first]
+        index.position = {gid: i for i, gid in enumerate(index.group_ids)}
+        index._train()
+        return index
+
+    def _train(self):
+        n = len(self.group_ids)
+        vectors = self.sums / np.maximum(self.norms, 1e-12)[:, None]
+        nlist = max(1, int(np.sqrt(n)))
+        # Как в faiss: для обучения квантизатора хватает десятков точек на список
+        rng = np.random.RandomState(0)
+        sample = vectors[rng.choice(n, min(n, 64 * nlist), replace=False)]
+        self.quantizer = _spherical_kmeans(sample, nlist)
+        self.assign = np.concatenate([
+            np.argmax(vectors[start:start + 4096] @ self.quantizer.T, axis=1)
+            for start in range(0, n, 4096)
+        ]).tolist()
+        self._fill_buckets()
+
+    def _fill_buckets(self):
+        self.buckets = {}
+        for i, (list_no, category) in enumerate(zip(self.assign, self.categories)):
+            self.buckets.setdefault((list_no, category), []).append(i)
+
+    def search(self, text: str, category: str = '') -> Optional[Tuple[str, float]]:
+        """Ближайшая группа той же категории и косинус с её центроидом"""
+        if not self.group_ids:
+            return None
+        query = text_vectors([text], self.dim)[0]
+        if not query.any():
+            return None
+        with self._lock:
+            probes = np.argsort(-(self.quantizer @ query))[:self.nprobe]
+            candidates = []
+            for list_no in probes.tolist():
+                candidates.extend(self.buckets.get((list_no, category or ''), ()))
+            if not candidates:
+                return None
+            candidates = np.asarray(candidates)
+            scores = (self.sums[candidates] @ query) / np.maximum(self.norms[candidates], 1e-12)
+            best = int(np.argmax(scores))
+            return self.group_ids[candidates[best]], float(scores[best])
+
+    def add(self, text: str, group_id: str, category: str = '', log: bool = True):
+        """Учесть товар группы group_id: центроид сдвигается, новая группа попадает в ближайший список"""
+        vector = text_vectors([text], self.dim)[0]
+        with self._lock:
+            i = self.position.get(group_id)
+            if i is None:
+                i = len(self.group_ids)
+                if i == len(self.sums):
+                    grown = np.zeros((max(16, 2 * i), self.dim), dtype=np.float32)
+                    grown[:i] = self.sums
+                    self.sums = grown
+                    self.norms = np.concatenate([self.norms, np.zeros(len(grown) - i, dtype=np.float32)])
+                    self.counts = np.concatenate([self.counts, np.zeros(len(grown) - i, dtype=np.int64)])
+                self.group_ids.append(group_id)
+                self.categories.append(category or '')
+                self.position[group_id] = i
+                if not len(self.quantizer):
+                    self.quantizer = vector[None, :].copy()
+                list_no = int(np.argmax(self.quantizer @ vector))
+                self.assign.append(list_no)
+                self.buckets.setdefault((list_no, category or ''), []).append(i)
+            self.sums[i] += vector
+            self.norms[i] = np.linalg.norm(self.sums[i])
+            self.counts[i] += 1
+            if log:
+                self._log({'text': text, 'group_id': group_id, 'category': category or ''})
+
+    def subtract(self, text: str, group_id: str, log: bool = True):
+        """Убрать товар из центроида группы (товар удалён, перенесён или изменён).
+
+        Группа, от которой не осталось участников, исключается из поиска:
+        остаток суммы после вычитаний — шум с почти нулевой нормой.
+        """
+        vector = text_vectors([text], self.dim)[0]
+        with self._lock:
+            i = self.position.get(group_id)
+            if i is None:
+                return
+            self.sums[i] -= vector
+            self.norms[i] = np.linalg.norm(self.sums[i])
+            self.counts[i] -= 1
+            if self.counts[i] <= 0:
+                self._drop_row(group_id)
+            if log:
+                self._log({'op': 'subtract', 'text': text, 'group_id': group_id})
+
+    def remove(self, group_id: str, log: bool = True):
+        """Исключить группу из поиска; её строка остаётся пустой до следующего save"""
+        with self._lock:
+            if group_id not in self.position:
+                return
+            self._drop_row(group_id)
+            if log:
+                self._log({'op': 'remove', 'group_id': group_id})
+
+    def _drop_row(self, group_id: str):
+        i = self.position.pop(group_id)
+        self.buckets[(self.assign[i], self.categories[i])].remove(i)
+        self.sums[i] = 0.0
+        self.norms[i] = 0.0
+        self.counts[i] = 0
+
+    def _log(self, entry: Dict):
+        if self.log_path is not None:
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def save(self, directory: Path):
+        """Сохранение индекса в directory/index.npz; журнал добавлений начинается заново"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        # Удалённые группы (remove) не сохраняются
+        live = sorted(self.position.values())
+        tmp = directory / 'index.tmp.npz'
+        np.savez(
+            tmp, quantizer=self.quantizer, sums=self.sums[live], counts=self.counts[live],
+            group_ids=np.asarray([self.group_ids[i] for i in live], dtype=str),
+            categories=np.asarray([self.categories[i] for i in live], dtype=str),
+            assign=np.asarray([self.assign[i] for i in live], dtype=np.int64),
+        )
+        os.replace(tmp, directory / 'index.npz')
+        self.log_path = directory / 'log.jsonl'
+        self.log_path.write_text('')
+
+    @classmethod
+    def load(cls, directory: Path, dim: int, nprobe: int = 8) -> Optional["GroupIndex"]:
+        """Индекс из directory с переигранным журналом; None — индекса нет или он другой размерности"""
+        directory = Path(directory)
+        path = directory / 'index.npz'
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            # Индекс без counts сохранён прежней версией — строится заново
+            if data['sums'].shape[1] != dim or 'counts' not in data:
+                return None
+            index = cls(dim, nprobe)
+            index.quantizer = data['quantizer']
+            index.sums = data['sums'].copy()
+            index.counts = data['counts'].copy()
+            index.group_ids = data['group_ids'].tolist()
+            index.categories = data['categories'].tolist()
+            index.assign = data['assign'].tolist()
+        index.norms = np.linalg.norm(index.sums, axis=1).astype(np.float32)
+        index.position = {gid: i for i, gid in enumerate(index.group_ids)}
+        index._fill_buckets()
+        log_path = directory / 'log.jsonl'
+        if log_path.exists():
+            with open(log_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Оборванная последняя строка после сбоя
+                        continue
+                    op = entry.get('op', 'add')
+                    if op == 'add':
+                        index.add(entry['text'], entry['group_id'], entry['category'], log=False)
+                    elif op == 'subtract':
+                        index.subtract(entry['text'], entry['group_id'], log=False)
+                    elif op == 'remove':
+                        index.remove(entry['group_id'], log=False)
+        index.log_path = log_path
+        return index
+
+    @staticmethod
+    def drop(directory: Path):
+        """Удаление сохранённого индекса (группы перестроены целиком)"""
+        for name in ('index.npz', 'log.jsonl'):
+            (Path(directory) / name).unlink(missing_ok=True)
@@ -1,21 +1,86 @@
 # backend/app/services/grouping_core.py
+import hashlib
+import json
+import os
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
 import re
 from rapidfuzz import fuzz, process
+from rapidfuzz.distance import Jaro
 import logging
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.cluster import DBSCAN
-import jellyfish
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components, minimum_spanning_tree
+import time
+from app.services.minhash import MinHashLSH
+from app.core.config import (
+    GROUPING_MAX_BLOCK_SIZE, GROUPING_WORKERS, GROUPING_PARALLEL_MIN_ROWS, GROUPING_VERIFY_WORKERS,
+    GROUPING_MIN_MEMBER_SIMILARITY, GROUPING_VERIFY_SAMPLE_SIZE,
+    TFIDF_CACHE_DIR, TFIDF_CACHE_MIN_ROWS, TFIDF_CACHE_MAX_ENTRIES,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Поля сигнатуры в порядке build_product_signature: приоритетные поля и ключевые характеристики
+PRIORITY_FIELDS = ['model', 'name', 'manufacturer', 'category']
+KEY_CHARACTERISTICS = ['цвет', 'color', 'размер', 'size', 'модель', 'model', 'тип', 'type']
+# Колонки-источники полей признаков: английское имя имеет приоритет над русским
+FEATURE_COLUMNS = {
+    'name': ('name', 'название сте'),
+    'model': ('model', 'модель'),
+    'manufacturer': ('manufacturer', 'производитель'),
+    'category': ('category_name', 'название категории'),
+}
+CHARACTERISTICS_COLUMNS = ('characteristics', 'характеристики')
+# Ключ хеша исходных полей в кэше сигнатур (storage.ensure_signatures), ровно 16 символов.
+# Меняется вместе с логикой build_signatures — тогда кэш пересчитывается целиком
+SIGNATURE_HASH_KEY = 'th-signatures-v1'
+
+# Предкомпилированные шаблоны preprocess_text и parse_characteristics
+_non_word_re = re.compile(r'[^\w\s]')
+_spaces_re = re.compile(r'\s+')
+_characteristic_sep_re = re.compile(r'[;|,·•]')
+_non_word_run_re = re.compile(r'\W+')
+
+# eps при strictness = 0: по графу этого радиуса строится остовное дерево иерархического режима
+TREE_MAX_EPS = 0.7
+# minimum_spanning_tree не видит рёбер нулевого веса, поэтому к расстояниям добавляется сдвиг
+_MST_WEIGHT_OFFSET = 1e-9
+
+# Ключи дробления блоков, которые крупнее max_block_size (в порядке применения)
+SUB_BLOCK_FIELDS = ('manufacturer', 'name_prefix')
+
 class ProductGrouper:
-    def __init__(self, strictness: float = 0.7):
+    # Сколько строк TF-IDF перемножается за раз при построении графа соседей
+    graph_chunk_size = 256
+    # Сколько строк матрицы схожести считает один вызов cdist при проверке кластеров
+    verify_chunk_size = 1024
+    # С каким числом участников сравнивается каждый в крупном кластере
+    verify_sample_size = GROUPING_VERIFY_SAMPLE_SIZE
+
+    def __init__(self, strictness: float = 0.7, block_by_manufacturer: bool = False,
+                 max_block_size: int = GROUPING_MAX_BLOCK_SIZE, workers: Optional[int] = GROUPING_WORKERS,
+                 use_minhash: bool = False, min_member_similarity: Optional[float] = GROUPING_MIN_MEMBER_SIMILARITY,
+                 hierarchical: bool = False):
         self.strictness = strictness
+        # Иерархический режим: остовное дерево блока строится один раз, strictness — его разрез
+        self.hierarchical = hierarchical
+        # MinHash/LSH вместо TF-IDF + DBSCAN: для очень крупных каталогов
+        self.use_minhash = use_minhash
+        # Участники кластера со средней схожестью (calculate_similarity) ниже порога отделяются.
+        # MinHash проверяет кандидатные пары сам, к нему порог не применяется
+        self.min_member_similarity = min_member_similarity
+        # Счётчики последней агрегации (кандидатные пары MinHash и т.п.)
+        self.stats: Counter = Counter()
+        # Товары разных категий (и, по желанию, производителей) в одну группу не попадают
+        self.block_fields = ('category', 'manufacturer') if block_by_manufacturer else ('category',)
+        self.max_block_size = max_block_size
+        self.workers = workers
         self.vectorizer = TfidfVectorizer(
             max_features=1000,
             stop_words=None,
@@ -28,8 +93,8 @@ class ProductGrouper:
         if pd.isna(text):
             return ""
         text = str(text).lower()
-        text = re.sub(r'[^\w\s]', ' ', text)
-        text = re.sub(r'\s+', ' ', text)
+        text = _non_word_re.sub(' ', text)
+        text = _spaces_re.sub(' ', text)
         return text.strip()
     
     def extract_key_features(self, row: pd.Series) -> Dict:
@@ -57,7 +122,7 @@ class ProductGrouper:
             
         text = str(text)
         # Разные разделители
-        parts = re.split(r'[;|,·•]', text)
+        parts = _characteristic_sep_re.split(text)
         
         for part in parts:
             part = part.strip()
@@ -83,19 +148,108 @@ class ProductGrouper:
         signature_parts = []
         
         # Приоритетные поля для группировки
-        priority_fields = ['model', 'name', 'manufacturer', 'category']
-        for field in priority_fields:
+        for field in PRIORITY_FIELDS:
             if features.get(field):
                 signature_parts.append(features[field])
         
         # Ключевые характеристики
-        key_chars = ['цвет', 'color', 'размер', 'size', 'модель', 'model', 'тип', 'type']
-        for char_key in key_chars:
+        for char_key in KEY_CHARACTERISTICS:
             if char_key in features:
                 signature_parts.append(features[char_key])
                 
         return ' '.join(signature_parts)
     
+    def preprocess_series(self, series: pd.Series) -> pd.Series:
+        """preprocess_text для целой колонки (пропуски -> пустая строка).
+
+        Нормализуются только уникальные значения: в колонках каталога
+        (категории, бренды, ключи характеристик) повторов очень много.
+        """
+        codes, uniques = pd.factorize(series.map(str, na_action='ignore'))
+        # Замена пунктуации на пробел и схлопывание пробелов = замена серий \W на один пробел
+        text = pd.Series(uniques, dtype=object).str.lower().str.replace(_non_word_run_re, ' ', regex=True)
+        text = np.append(text.str.strip().to_numpy(dtype=object), '')
+        # factorize кодирует пропуски как -1 — это последний элемент, пустая строка
+        return pd.Series(text[codes], index=series.index, dtype=object)
+
+    def parse_characteristics_series(self, series: pd.Series, keys: List[str]) -> pd.DataFrame:
+        """parse_characteristics для целой колонки, только для ключей keys.
+
+        Строки разбиваются на части одним explode; для каждого товара и
+        ключа остаётся последнее значение, как при обновлении словаря.
+        Результат — DataFrame с колонками keys (NaN — ключа нет) по индексу series.
+        """
+        parts = series.dropna().map(str).astype(object).str.split(_characteristic_sep_re).explode().str.strip()
+        parts = parts[parts.str.len() > 0]
+        if parts.empty:
+            return pd.DataFrame(index=series.index, columns=keys, dtype=object)
+        rows = parts.index
+        # Позиционный индекс сохраняет порядок частей внутри строки
+        parts = parts.reset_index(drop=True)
+
+        # Разделитель ключа и значения: ':', иначе '=', иначе '-' не в начале
+        has_colon = parts.str.contains(':', regex=False)
+        has_equals = ~has_colon & parts.str.contains('=', regex=False)
+        has_dash = ~has_colon & ~has_equals & parts.str.contains('-', regex=False) & ~parts.str.startswith('-')
+        key = pd.Series(None, index=parts.index, dtype=object)
+        value = pd.Series(None, index=parts.index, dtype=object)
+        for mask, sep in ((has_colon, ':'), (has_equals, '='), (has_dash, '-')):
+            if not mask.any():
+                continue
+            split = parts[mask].str.partition(sep)
+            key[mask] = split[0]
+            value[mask] = split[2]
+
+        pairs = pd.DataFrame({'row': rows, 'key': key, 'value': value}).dropna(subset=['key'])
+        pairs['key'] = self.preprocess_series(pairs['key'])
+        pairs = pairs[pairs['key'].isin(keys) & (pairs['key'].str.len() > 2)]
+        pairs['value'] = self.preprocess_series(pairs['value'])
+        pairs = pairs[pairs['value'] != ''].drop_duplicates(['row', 'key'], keep='last')
+
+        return pairs.pivot(index='row', columns='key', values='value').reindex(index=series.index, columns=keys)
+
+    def build_signatures(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Признаки и сигнатуры всех товаров поколоночно.
+
+        Векторный аналог extract_key_features + build_product_signature:
+        сигнатуры совпадают посимвольно. Возвращает DataFrame с колонками
+        PRIORITY_FIELDS и signature, по позициям строк df.
+        """
+        df = df.reset_index(drop=True)
+        features = pd.DataFrame(index=df.index)
+        for field, columns in FEATURE_COLUMNS.items():
+            column = next((c for c in columns if c in df.columns), None)
+            features[field] = self.preprocess_series(df[column]) if column else ''
+
+        # Характеристики с такими же ключами перекрывают основные поля
+        chars_column = next((c for c in CHARACTERISTICS_COLUMNS if c in df.columns), None)
+        keys = list(dict.fromkeys(PRIORITY_FIELDS + KEY_CHARACTERISTICS))
+        if chars_column:
+            chars = self.parse_characteristics_series(df[chars_column], keys)
+        else:
+            chars = pd.DataFrame(index=df.index, columns=keys, dtype=object)
+        for field in PRIORITY_FIELDS:
+            features[field] = chars[field].fillna(features[field])
+
+        # ' '.join по присутствующим частям, собираемый колонка за колонкой
+        signature = pd.Series('', index=df.index, dtype=object)
+        started = pd.Series(False, index=df.index)
+        parts = [(features[field], features[field] != '') for field in PRIORITY_FIELDS]
+        for key in KEY_CHARACTERISTICS:
+            if key in PRIORITY_FIELDS:
+                # Основное поле есть в признаках всегда, даже пустым
+                parts.append((features[key], pd.Series(True, index=df.index)))
+            else:
+                parts.append((chars[key], chars[key].notna()))
+        for values, present in parts:
+            piece = values.where(present, '').astype(object)
+            piece = piece.where(~(started & present), ' ' + piece)
+            signature = signature + piece
+            started = started | present
+
+        features['signature'] = signature
+        return features
+
     def calculate_similarity(self, sig1: str, sig2: str) -> float:
         """Расчет схожести между двумя сигнатурами"""
         if not sig1 or not sig2:
@@ -104,43 +258,369 @@ class ProductGrouper:
         # Комбинированная метрика схожести
         token_ratio = fuzz.token_sort_ratio(sig1, sig2) / 100.0
         partial_ratio = fuzz.partial_ratio(sig1, sig2) / 100.0
-        jaro_similarity = jellyfish.jaro_similarity(sig1, sig2)
+        jaro_similarity = Jaro.normalized_similarity(sig1, sig2)
         
         # Взвешенное среднее
         similarity = (token_ratio * 0.4 + partial_ratio * 0.3 + jaro_similarity * 0.3)
         return similarity
     
+    def similarity_matrix(self, queries: List[str], choices: List[str]) -> np.ndarray:
+        """calculate_similarity для всех пар queries × choices пакетно через rapidfuzz cdist"""
+        kwargs = dict(dtype=np.float32, workers=GROUPING_VERIFY_WORKERS)
+        token_ratio = process.cdist(queries, choices, scorer=fuzz.token_sort_ratio, **kwargs) / 100.0
+        partial_ratio = process.cdist(queries, choices, scorer=fuzz.partial_ratio, **kwargs) / 100.0
+        jaro_similarity = process.cdist(queries, choices, scorer=Jaro.normalized_similarity, **kwargs)
+        similarity = token_ratio * 0.4 + partial_ratio * 0.3 + jaro_similarity * 0.3
+        # Как в calculate_similarity: с пустой сигнатурой схожесть нулевая
+        similarity[[not q for q in queries], :] = 0.0
+        similarity[:, [not c for c in choices]] = 0.0
+        return similarity
+
+    def pair_similarity(self, queries: List[str], choices: List[str]) -> np.ndarray:
+        """calculate_similarity для пар (queries[i], choices[i]) одним пакетом через rapidfuzz cpdist"""
+        kwargs = dict(dtype=np.float32, workers=GROUPING_VERIFY_WORKERS)
+        token_ratio = process.cpdist(queries, choices, scorer=fuzz.token_sort_ratio, **kwargs) / 100.0
+        partial_ratio = process.cpdist(queries, choices, scorer=fuzz.partial_ratio, **kwargs) / 100.0
+        jaro_similarity = process.cpdist(queries, choices, scorer=Jaro.normalized_similarity, **kwargs)
+        similarity = token_ratio * 0.4 + partial_ratio * 0.3 + jaro_similarity * 0.3
+        similarity[[not q or not c for q, c in zip(queries, choices)]] = 0.0
+        return similarity
+
+    def split_weak_members(self, signatures: List[str], labels: np.ndarray,
+                           weights: Optional[np.ndarray] = None) -> np.ndarray:
+        """Отделение слабых участников кластеров.
+
+        Для каждого участника считается средняя схожесть с остальными
+        участниками его кластера (weights — число копий сигнатуры); те, у кого
+        она ниже min_member_similarity, становятся шумом (-1). Кластер, от
+        которого остался один товар, тоже распадается. В кластерах крупнее
+        verify_sample_size среднее оценивается по равномерной выборке
+        участников — проверка остаётся линейной по размеру кластера.
+        """
+        labels = np.array(labels)
+        if weights is None:
+            weights = np.ones(len(signatures), dtype=np.int64)
+        started = time.perf_counter()
+        pairs = 0
+        for label in np.unique(labels[labels != -1]):
+            members = np.flatnonzero(labels == label)
+            member_signatures = [signatures[i] for i in members]
+            member_weights = weights[members].astype(np.float32)
+            total = member_weights.sum()
+            if total < 3:
+                # В паре слабого участника не выделить
+                continue
+            # Опорные участники, с которыми сравнивается каждый: все или равномерная выборка
+            reference = np.arange(len(members))
+            if len(members) > self.verify_sample_size:
+                reference = np.unique(np.linspace(0, len(members) - 1, self.verify_sample_size).astype(np.int64))
+            reference_signatures = [member_signatures[i] for i in reference]
+            reference_weights = member_weights[reference]
+            in_reference = np.zeros(len(members), dtype=np.float32)
+            in_reference[reference] = 1.0
+            reference_total = reference_weights.sum() - in_reference
+
+            mean_similarity = np.empty(len(members), dtype=np.float32)
+            for start in range(0, len(members), self.verify_chunk_size):
+                chunk = member_signatures[start:start + self.verify_chunk_size]
+                similarity = self.similarity_matrix(chunk, reference_signatures)
+                # Сама с собой сигнатура совпадает (1.0), её копии считаются как остальные
+                own = in_reference[start:start + len(chunk)]
+                mean_similarity[start:start + len(chunk)] = (
+                    (similarity @ reference_weights - own) / np.maximum(reference_total[start:start + len(chunk)], 1)
+                )
+                pairs += similarity.size
+            weak = members[mean_similarity < self.min_member_similarity]
+            labels[weak] = -1
+            if weights[labels == label].sum() < 2:
+                labels[labels == label] = -1
+        self.stats.update(verify_pairs=pairs, verify_seconds=time.perf_counter() - started)
+        return labels
+
     def cluster_products(self, signatures: List[str]) -> List[int]:
         """Кластеризация продуктов на основе их сигнатур"""
         if len(signatures) < 2:
             return [0] * len(signatures)
-            
+        if self.use_minhash:
+            # Без split_weak_members: пары уже проверены calculate_similarity с порогом выше strictness
+            return self.cluster_minhash(signatures)
+
+
         try:
-            # TF-IDF векторизация
-            tfidf_matrix = self.vectorizer.fit_transform(signatures)
-            
-            # Косинусная схожесть
-            similarity_matrix = cosine_similarity(tfidf_matrix)
-            
-            # DBSCAN кластеризация с адаптивным eps
-            eps = 0.7 - (self.strictness * 0.3)  # strictness 0.7 -> eps 0.49
-            clustering = DBSCAN(
-                eps=eps,
-                min_samples=2,
-                metric='precomputed'
-            )
-            
-            # Преобразование в расстояние
-            distance_matrix = 1 - similarity_matrix
-            labels = clustering.fit_predict(distance_matrix)
+            # Точные дубликаты схлопываются в одну точку с весом = числу копий.
+            # Словарь и idf считаются по всем сигнатурам, поэтому векторы и
+            # метки совпадают с кластеризацией без схлопывания
+            unique_signatures, inverse, weights = fingerprint_signatures(signatures)
+
+            eps = strictness_eps(self.strictness)  # strictness 0.7 -> eps 0.49
+            try:
+                if self.hierarchical:
+                    tree = self.spanning_tree(signatures, unique_signatures)
+                else:
+                    # TF-IDF векторизация (строки нормированы по L2)
+                    tfidf_matrix = self.tfidf_matrix(signatures, unique_signatures)
+            except ValueError:
+                # Словарь пуст: ни одно слово не встречается дважды (min_df=2),
+                # значит похожих пар нет и все товары — шум
+                return [-1] * len(signatures)
+
+            if self.hierarchical:
+                labels = cut_tree(tree, weights, eps)
+            else:
+                # DBSCAN кластеризация с адаптивным eps
+                clustering = DBSCAN(
+                    eps=eps,
+                    min_samples=2,
+                    metric='precomputed'
+                )
+
+                # Строки без признаков от всех на расстоянии 1 > eps — это шум.
+                # В граф их не берём: DBSCAN проставляет разреженной матрице диагональ
+                labels = np.full(len(unique_signatures), -1)
+                nonempty = np.flatnonzero(tfidf_matrix.getnnz(axis=1))
+                if len(nonempty):
+                    distance_graph = self.radius_graph(tfidf_matrix[nonempty], eps)
+                    labels[nonempty] = clustering.fit_predict(distance_graph, sample_weight=weights[nonempty])
+            if self.min_member_similarity is not None:
+                labels = self.split_weak_members(unique_signatures, labels, weights)
             
-            return labels
+            return labels[inverse]
             
         except Exception as e:
             logger.warning(f"Clustering failed: {e}, using fallback")
             # Фолбэк: группировка по первым словам названия
             return self.fallback_clustering(signatures)
     
+    def tfidf_matrix(self, signatures: List[str], unique_signatures: List[str]) -> sparse.csr_matrix:
+        """TF-IDF уникальных сигнатур блока (словарь по всем signatures) с кэшем на диске.
+
+        Ключ — хеш сигнатур блока и параметров векторизатора, strictness в
+        него не входит: переагрегация с другой строгостью берёт готовую
+        матрицу и пересчитывает только граф соседей и кластеры. Изменённый
+        каталог даёт другой ключ, старые записи вытесняет prune_tfidf_cache.
+        """
+        if len(unique_signatures) < TFIDF_CACHE_MIN_ROWS:
+            return self.vectorizer.fit(signatures).transform(unique_signatures)
+
+        matrix_path = TFIDF_CACHE_DIR / f'{self._cache_key(signatures)}.npz'
+        if matrix_path.exists():
+            try:
+                matrix = sparse.load_npz(matrix_path).tocsr()
+                os.utime(matrix_path)
+                self.stats.update(tfidf_cache_hits=1)
+                return matrix
+            except Exception as e:
+                logger.warning(f"Failed to read TF-IDF cache {matrix_path.name}: {e}")
+
+        matrix = self.vectorizer.fit(signatures).transform(unique_signatures)
+        self.stats.update(tfidf_cache_misses=1)
+        try:
+            TFIDF_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            # Запись через временный файл: параллельные воркеры не увидят недописанный
+            tmp_path = matrix_path.with_name(f'{matrix_path.stem}.{os.getpid()}.tmp.npz')
+            sparse.save_npz(tmp_path, matrix)
+            os.replace(tmp_path, matrix_path)
+        except OSError as e:
+            logger.warning(f"Failed to write TF-IDF cache: {e}")
+        return matrix
+
+    def _cache_key(self, signatures: List[str], *extra) -> str:
+        """Ключ дискового кэша блока: параметры векторизатора, extra и сигнатуры"""
+        key = hashlib.sha1(json.dumps([self.vectorizer.get_params(), *extra], sort_keys=True, default=str).encode())
+        key.update('\n'.join(signatures).encode())
+        return key.hexdigest()
+
+    def spanning_tree(self, signatures: List[str], unique_signatures: List[str]) -> Dict[str, np.ndarray]:
+        """Минимальное остовное дерево (лес) single linkage по уникальным сигнатурам блока.
+
+        Строится по графу косинусных расстояний радиуса TREE_MAX_EPS и
+        кэшируется на диске рядом с матрицами TF-IDF. Разрез дерева по eps
+        (cut_tree) даёт те же группы, что DBSCAN с min_samples=2: при таком
+        min_samples каждая точка с соседом — ядро, и кластеры DBSCAN
+        совпадают с компонентами связности графа радиуса eps.
+        Возвращает nonempty (строки с ненулевым вектором) и рёбра u, v, d.
+        """
+        cache_path = TFIDF_CACHE_DIR / f'tree-{self._cache_key(signatures, TREE_MAX_EPS)}.npz'
+        cached = len(unique_signatures) >= TFIDF_CACHE_MIN_ROWS
+        if cached and cache_path.exists():
+            try:
+                with np.load(cache_path) as data:
+                    tree = {name: data[name] for name in ('nonempty', 'u', 'v', 'd')}
+                os.utime(cache_path)
+                self.stats.update(tree_cache_hits=1)
+                return tree
+            except Exception as e:
+                logger.warning(f"Failed to read tree cache {cache_path.name}: {e}")
+
+        tfidf_matrix = self.tfidf_matrix(signatures, unique_signatures)
+        nonempty = np.flatnonzero(tfidf_matrix.getnnz(axis=1))
+        graph = self.radius_graph(tfidf_matrix[nonempty], TREE_MAX_EPS).tocoo()
+        off_diagonal = graph.row != graph.col
+        shifted = sparse.csr_matrix(
+            (graph.data[off_diagonal] + _MST_WEIGHT_OFFSET, (graph.row[off_diagonal], graph.col[off_diagonal])),
+            shape=graph.shape,
+        )
+        mst = minimum_spanning_tree(shifted).tocoo()
+        tree = {
+            'nonempty': nonempty,
+            'u': nonempty[mst.row],
+            'v': nonempty[mst.col],
+            # Исходные расстояния берём из графа, а не вычитаем сдвиг: сравнение с eps остаётся точным
+            'd': np.asarray(graph.tocsr()[mst.row, mst.col]).ravel(),
+        }
+        self.stats.update(tree_cache_misses=1)
+        if cached:
+            try:
+                TFIDF_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                tmp_path = cache_path.with_name(f'{cache_path.stem}.{os.getpid()}.tmp.npz')
+                np.savez(tmp_path, **tree)
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                logger.warning(f"Failed to write tree cache: {e}")
+        return tree
+
+    def neighbour_mask(self, features: pd.DataFrame, affected: np.ndarray) -> np.ndarray:
+        """Затронутые товары и их соседи: товары того же блока в радиусе eps от затронутого.
+
+        features — результат build_signatures по каталогу, affected — булева
+        маска по его позициям. Просматриваются только блоки, где есть
+        затронутые товары, и только строки матрицы схожести для них.
+        """
+        signatures = features['signature'].tolist()
+        eps = strictness_eps(self.strictness)
+        mask = np.array(affected, dtype=bool)
+        for block in self.build_blocks(features[PRIORITY_FIELDS].to_dict('records')):
+            block = np.asarray(block)
+            block_affected = mask[block]
+            if len(block) < 2 or not block_affected.any():
+                continue
+            block_signatures = [signatures[i] for i in block]
+            unique_signatures, inverse, _ = fingerprint_signatures(block_signatures)
+            try:
+                matrix = self.tfidf_matrix(block_signatures, unique_signatures)
+            except ValueError:
+                continue
+            similarity = (matrix[np.unique(inverse[block_affected])] @ matrix.T).tocsr()
+            near = np.zeros(len(unique_signatures), dtype=bool)
+            near[similarity.indices[1.0 - similarity.data <= eps]] = True
+            mask[block] |= near[inverse]
+        return mask
+
+    def strictness_preview(self, df: pd.DataFrame, strictness_values: List[float],
+                           features: Optional[pd.DataFrame] = None) -> List[Dict]:
+        """Число групп для каждого значения strictness без записи в БД.
+
+        Деревья блоков строятся (или берутся из кэша) один раз, каждое
+        значение strictness — разрез и, как в cluster_products, проверка
+        участников при заданном min_member_similarity — числа совпадают с
+        aggregate_df в иерархическом режиме.
+        """
+        if features is None:
+            features = self.build_signatures(df)
+        signatures = features['signature'].tolist()
+        blocks = self.build_blocks(features[PRIORITY_FIELDS].to_dict('records'))
+
+        prepared = []
+        singles = 0
+        for block in blocks:
+            block_signatures = [signatures[i] for i in block]
+            if len(block) < 2:
+                singles += len(block)
+                continue
+            unique_signatures, inverse, weights = fingerprint_signatures(block_signatures)
+            try:
+                tree = self.spanning_tree(block_signatures, unique_signatures)
+            except ValueError:
+                singles += len(block)
+                continue
+            prepared.append((tree, unique_signatures, inverse, weights))
+
+        preview = []
+        for strictness in strictness_values:
+            eps = strictness_eps(strictness)
+            groups, grouped = 0, 0
+            for tree, unique_signatures, inverse, weights in prepared:
+                labels = cut_tree(tree, weights, eps)
+                if self.min_member_similarity is not None:
+                    labels = self.split_weak_members(unique_signatures, labels, weights)
+                labels = labels[inverse]
+                clustered = labels[labels != -1]
+                groups += len(np.unique(clustered))
+                grouped += len(clustered)
+            preview.append({
+                'strictness': strictness,
+                'groups': groups,
+                'grouped_products': grouped,
+                'singles': len(signatures) - grouped,
+            })
+        return preview
+
+    def cluster_minhash(self, signatures: List[str]) -> np.ndarray:
+        """Кластеризация через MinHash/LSH.
+
+        Кандидатные пары берутся из LSH-бакетов (полосы и строки зависят от
+        strictness), проверяются calculate_similarity >= 0.75 + 0.25 * strictness и
+        объединяются в компоненты связности. Точные дубликаты схлопываются
+        заранее и всегда попадают в одну группу.
+        """
+        unique_signatures, inverse, weights = fingerprint_signatures(signatures)
+        lsh = MinHashLSH.for_strictness(self.strictness)
+        candidates = lsh.candidate_pairs(lsh.signatures(unique_signatures))
+
+        parent = list(range(len(unique_signatures)))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        # calculate_similarity высок даже у соседних моделей одной серии, поэтому порог выше strictness
+        threshold = 0.75 + 0.25 * self.strictness
+        verified = 0
+        for i, j in candidates:
+            if self.calculate_similarity(unique_signatures[i], unique_signatures[j]) >= threshold:
+                verified += 1
+                parent[find(i)] = find(j)
+
+        roots = [find(i) for i in range(len(unique_signatures))]
+        sizes = Counter()
+        for i, root in enumerate(roots):
+            sizes[root] += weights[i]
+        # Группа — компонента хотя бы из двух товаров; пустые сигнатуры — шум
+        labels = np.array([
+            root if sizes[root] >= 2 and unique_signatures[i] else -1
+            for i, root in enumerate(roots)
+        ], dtype=int)
+
+        self.stats.update(products=len(signatures), unique_signatures=len(unique_signatures),
+                          candidate_pairs=len(candidates), verified_pairs=verified)
+        return labels[inverse]
+
+    def radius_graph(self, tfidf_matrix: sparse.csr_matrix, eps: float) -> sparse.csr_matrix:
+        """Разреженный граф косинусных расстояний <= eps.
+
+        Вместо плотной матрицы N×N произведения X·Xᵀ считаются блоками по
+        graph_chunk_size строк, и в CSR остаются только пары в радиусе eps,
+        так что память растёт с числом соседей, а не как N².
+        Нулевые расстояния хранятся явно: для DBSCAN отсутствующий элемент
+        означает «не сосед».
+        """
+        n = tfidf_matrix.shape[0]
+        rows, cols, dists = [], [], []
+        for start in range(0, n, self.graph_chunk_size):
+            block = (tfidf_matrix[start:start + self.graph_chunk_size] @ tfidf_matrix.T).tocoo()
+            # 1 - cos из-за округления бывает чуть меньше нуля
+            dist = np.maximum(1.0 - block.data, 0.0)
+            mask = dist <= eps
+            rows.append(block.row[mask] + start)
+            cols.append(block.col[mask])
+            dists.append(dist[mask])
+        return sparse.csr_matrix(
+            (np.concatenate(dists), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(n, n),
+        )
+
     def fallback_clustering(self, signatures: List[str]) -> List[int]:
         """Простая группировка по первым словам"""
         groups = {}
@@ -163,49 +643,220 @@ class ProductGrouper:
             
         return labels
     
-    def aggregate_df(self, df: pd.DataFrame) -> Dict[str, List[int]]:
-        """Основная функция агрегации"""
+    def build_blocks(self, features_list: List[Dict]) -> List[List[int]]:
+        """Разбиение товаров (позиций в features_list) на независимые блоки"""
+        parts: Dict[Tuple[str, ...], List[int]] = {}
+        for i, features in enumerate(features_list):
+            key = tuple(_block_value(features, field) for field in self.block_fields)
+            parts.setdefault(key, []).append(i)
+
+        sub_fields = [field for field in SUB_BLOCK_FIELDS if field not in self.block_fields]
+        blocks = []
+        for indices in parts.values():
+            blocks.extend(self._split_block(indices, features_list, sub_fields))
+        return blocks
+
+    def _split_block(self, indices: List[int], features_list: List[Dict], fields: List[str]) -> List[List[int]]:
+        """Дробление слишком крупного блока следующим ключом из fields"""
+        if len(indices) <= self.max_block_size or not fields:
+            return [indices]
+        parts: Dict[str, List[int]] = {}
+        for i in indices:
+            parts.setdefault(_block_value(features_list[i], fields[0]), []).append(i)
+        blocks = []
+        for part in parts.values():
+            blocks.extend(self._split_block(part, features_list, fields[1:]))
+        return blocks
+
+    def worker_params(self) -> Dict:
+        """Параметры ProductGrouper для процессов-воркеров cluster_blocks"""
+        return dict(strictness=self.strictness, use_minhash=self.use_minhash,
+                    min_member_similarity=self.min_member_similarity, hierarchical=self.hierarchical)
+
+    def cluster_blocks(self, blocks: List[List[str]]) -> List[List[int]]:
+        """Кластеризация сигнатур каждого блока; метки локальны для блока.
+
+        Крупные входы раскладываются по ProcessPoolExecutor: большие блоки
+        идут отдельными задачами первыми, мелкие упаковываются в пачки.
+        """
+        labels: List[List[int]] = [[-1] * len(block) for block in blocks]
+        # Товар, единственный в своём блоке, ни с чем не группируется
+        pending = sorted((i for i, block in enumerate(blocks) if len(block) >= 2),
+                         key=lambda i: len(blocks[i]), reverse=True)
+        total = sum(len(blocks[i]) for i in pending)
+
+        if len(pending) > 1 and total >= GROUPING_PARALLEL_MIN_ROWS and self.workers != 1:
+            workers = self.workers or os.cpu_count() or 1
+            # Примерно по 4 задачи на воркер: крупный блок не оставляет остальных без работы
+            batch_rows = max(total // (workers * 4), 1)
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = {
+                        executor.submit(_cluster_blocks, self.worker_params(), [blocks[i] for i in batch]): batch
+                        for batch in _pack_batches(pending, blocks, batch_rows)
+                    }
+                    for future in as_completed(futures):
+                        batch_labels, stats = future.result()
+                        for i, block_labels in zip(futures[future], batch_labels):
+                            labels[i] = block_labels
+                        self.stats.update(stats)
+                return labels
+            except Exception as e:
+                logger.warning(f"Parallel clustering failed: {e}, clustering blocks in-process")
+
+        for i in pending:
+            labels[i] = list(self.cluster_products(blocks[i]))
+        return labels
+
+    def aggregate_df(self, df: pd.DataFrame, features: Optional[pd.DataFrame] = None) -> Dict[str, List[int]]:
+        """Основная функция агрегации.
+
+        features — готовый результат build_signatures по позициям df
+        (например, из кэша storage.ensure_signatures); без него признаки
+        строятся заново.
+        """
         logger.info(f"Starting aggregation for {len(df)} products with strictness {self.strictness}")
         
         if df.empty:
             return {}
+        self.stats.clear()
             
-        # Извлечение признаков
-        features_list = []
-        signatures = []
-        
-        for idx, row in df.iterrows():
-            features = self.extract_key_features(row)
-            features_list.append(features)
-            signature = self.build_product_signature(features)
-            signatures.append(signature)
+        # Извлечение признаков и сигнатур поколоночно
+        if features is None:
+            features = self.build_signatures(df)
+        signatures = features['signature'].tolist()
+        features_list = features[PRIORITY_FIELDS].to_dict('records')
         
-        # Кластеризация
-        labels = self.cluster_products(signatures)
+        logger.info(f"{len(set(signatures))} distinct signatures among {len(signatures)} products")
+
+        # Блокинг и кластеризация внутри блоков
+        blocks = self.build_blocks(features_list)
+        block_labels = self.cluster_blocks([[signatures[i] for i in block] for block in blocks])
+        logger.info(f"Clustered {len(blocks)} blocks, largest has {max(map(len, blocks))} products")
+        if self.stats['tfidf_cache_hits'] or self.stats['tfidf_cache_misses']:
+            logger.info(f"TF-IDF cache: {self.stats['tfidf_cache_hits']} hits, "
+                        f"{self.stats['tfidf_cache_misses']} misses")
+            prune_tfidf_cache()
+        if self.use_minhash:
+            logger.info(f"MinHash: {self.stats['candidate_pairs']} candidate pairs, "
+                        f"{self.stats['verified_pairs']} verified")
+        if self.stats['verify_pairs']:
+            rate = self.stats['verify_pairs'] / max(self.stats['verify_seconds'], 1e-9)
+            logger.info(f"Verified {self.stats['verify_pairs']} member pairs ({rate:.0f} pairs/sec)")
         
-        # Формирование групп
+        # Формирование групп: локальные метки блоков -> глобальные id
         groups = {}
-        group_counter = 0
+        single_indices = []
         
-        for label in set(labels):
-            if label == -1:  # Шум
-                continue
-                
-            indices = [i for i, l in enumerate(labels) if l == label]
-            if len(indices) >= 1:  # Группы из 1+ элемента
-                group_id = f"grp_{group_counter}"
-                groups[group_id] = indices
-                group_counter += 1
+        for block, labels in zip(blocks, block_labels):
+            members: Dict[int, List[int]] = {}
+            for idx, label in zip(block, labels):
+                if label == -1:  # Шум
+                    single_indices.append(idx)
+                else:
+                    members.setdefault(label, []).append(idx)
+            for indices in members.values():
+                groups[f"grp_{len(groups)}"] = indices
         
         # Одиночные товары
-        single_indices = [i for i, l in enumerate(labels) if l == -1]
+        single_indices.sort()
         for i, idx in enumerate(single_indices):
             groups[f"single_{i}"] = [idx]
             
         logger.info(f"Created {len(groups)} groups")
         return groups
 
-def aggregate_df(df: pd.DataFrame, strictness: float = 0.7) -> Dict[str, List[int]]:
+def _block_value(features: Dict, field: str) -> str:
+    """Значение ключа блокинга (поля признаков уже нормализованы preprocess_text)"""
+    if field == 'name_prefix':
+        return (features.get('name') or '').split(' ', 1)[0]
+    return features.get(field) or ''
+
+
+def strictness_eps(strictness: float) -> float:
+    """Радиус (косинусное расстояние) кластеризации для строгости"""
+    return 0.7 - (strictness * 0.3)
+
+
+def cut_tree(tree: Dict[str, np.ndarray], weights: np.ndarray, eps: float) -> np.ndarray:
+    """Разрез остовного дерева spanning_tree на расстоянии eps.
+
+    Метки — компоненты связности по рёбрам длиной <= eps, пронумерованные
+    в порядке первого появления, как у DBSCAN; компонента из одного товара
+    и строки без признаков — шум (-1).
+    """
+    n = len(weights)
+    keep = tree['d'] <= eps
+    graph = sparse.csr_matrix((np.ones(int(keep.sum())), (tree['u'][keep], tree['v'][keep])), shape=(n, n))
+    _, components = connected_components(graph, directed=False)
+
+    clustered = np.zeros(n, dtype=bool)
+    clustered[tree['nonempty']] = True
+    clustered &= np.bincount(components, weights=weights)[components] >= 2
+
+    labels = np.full(n, -1)
+    _, first, inverse = np.unique(components[clustered], return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=int)
+    rank[np.argsort(first)] = np.arange(len(first))
+    labels[clustered] = rank[inverse]
+    return labels
+
+
+def fingerprint_signatures(signatures: List[str]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """Схлопывание точных дубликатов по MD5-отпечатку сигнатуры.
+
+    Возвращает уникальные сигнатуры в порядке первого появления, для каждой
+    позиции — номер её уникальной сигнатуры, и число копий каждой уникальной.
+    """
+    index: Dict[str, int] = {}
+    unique_signatures: List[str] = []
+    inverse = np.empty(len(signatures), dtype=np.intp)
+    for i, signature in enumerate(signatures):
+        fingerprint = hashlib.md5(signature.encode()).hexdigest()
+        j = index.get(fingerprint)
+        if j is None:
+            j = index[fingerprint] = len(unique_signatures)
+            unique_signatures.append(signature)
+        inverse[i] = j
+    weights = np.bincount(inverse, minlength=len(unique_signatures))
+    return unique_signatures, inverse, weights
+
+
+def prune_tfidf_cache(max_entries: int = TFIDF_CACHE_MAX_ENTRIES) -> None:
+    """Удаление давно не использованных матриц TF-IDF сверх max_entries"""
+    if not TFIDF_CACHE_DIR.exists():
+        return
+    entries = sorted(TFIDF_CACHE_DIR.glob('*.npz'), key=lambda path: path.stat().st_mtime, reverse=True)
+    for path in entries[max_entries:]:
+        path.unlink(missing_ok=True)
+
+
+def _pack_batches(order: List[int], blocks: List[List], batch_rows: int) -> List[List[int]]:
+    """Пачки блоков (в порядке order) суммарно примерно по batch_rows товаров"""
+    batches, current, rows = [], [], 0
+    for i in order:
+        current.append(i)
+        rows += len(blocks[i])
+        if rows >= batch_rows:
+            batches.append(current)
+            current, rows = [], 0
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _cluster_blocks(params: Dict, blocks: List[List[str]]) -> Tuple[List[List[int]], Counter]:
+    """Задача процесса-воркера: метки для пачки блоков и счётчики (функция верхнего уровня, чтобы пиклилась)"""
+    grouper = ProductGrouper(**params)
+    labels = [list(grouper.cluster_products(signatures)) for signatures in blocks]
+    return labels, grouper.stats
+
+
+def aggregate_df(df: pd.DataFrame, strictness: float = 0.7,
+                 block_by_manufacturer: bool = False, use_minhash: bool = False,
+                 min_member_similarity: Optional[float] = GROUPING_MIN_MEMBER_SIMILARITY, hierarchical: bool = False,
+                 features: Optional[pd.DataFrame] = None) -> Dict[str, List[int]]:
     """Основная функция для импорта"""
-    grouper = ProductGrouper(strictness)
-    return grouper.aggregate_df(df)
\ No newline at end of file
+    grouper = ProductGrouper(strictness, block_by_manufacturer=block_by_manufacturer, use_minhash=use_minhash,
+                             min_member_similarity=min_member_similarity, hierarchical=hierarchical)
+    return grouper.aggregate_df(df, features=features)
\ No newline at end of file
@@ -1,15 +1,18 @@
 import pandas as pd
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.cluster import DBSCAN
 import hashlib
 from typing import Dict, List, Tuple
 import os
+from .engines import get_model
 
 # Загружаем локальную модель (80 МБ)
 MODEL_PATH = os.path.join(os.path.dirname(__file__), "../../models/all-MiniLM-L6-v2")
-embedder = SentenceTransformer('all-MiniLM-L6-v2')  # автоматически скачает при первом запуске
+MODEL_NAME = 'all-MiniLM-L6-v2'  # автоматически скачает при первом использовании (engines.get_model)
+
+def warmup():
+    get_model(MODEL_NAME)
 
 # Значимые характеристики по категориям (холодный старт)
 SIGNIFICANT_BY_CATEGORY = {
@@ -73,7 +76,7 @@ def second_pass_ml_clustering(df_remaining: pd.DataFrame, eps=0.4) -> Dict[str,
             df_remaining['модель'].fillna('') + " " + \
             df_remaining['characteristics_raw'].fillna('')
     
-    embeddings = embedder.encode(texts.tolist(), show_progress_bar=False)
+    embeddings = get_model(MODEL_NAME).encode(texts.tolist(), show_progress_bar=False)
     clustering = DBSCAN(eps=eps, min_samples=2, metric='cosine')
     labels = clustering.fit_predict(embeddings)
     
@@ -1,18 +1,36 @@
 # backend/app/services/grouping_v2.py
 from typing import Dict, List
 import re
+import threading
 import pandas as pd
-from sentence_transformers import SentenceTransformer
 import numpy as np
 from sklearn.cluster import AgglomerativeClustering
-from sklearn.metrics.pairwise import cosine_similarity
 from rapidfuzz import fuzz
 import logging
+from app.core.config import EMBEDDING_STORE_DIR, EMBEDDING_DTYPE
+from .embedding_store import EmbeddingStore
+from .engines import get_model
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Новая модель: русская для лучшей точности
-MODEL = SentenceTransformer('ai-forever/sbert_large_nlu_ru')
+# (загружается при первом использовании, см. engines.get_model)
+MODEL_NAME = 'ai-forever/sbert_large_nlu_ru'
+
+# Векторы сигнатур на диске: модель кодирует только новые и изменённые
+_store = None
+_store_lock = threading.Lock()
+
+def get_store() -> EmbeddingStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            dim = get_model(MODEL_NAME).get_sentence_embedding_dimension()
+            _store = EmbeddingStore.for_model(EMBEDDING_STORE_DIR, MODEL_NAME, dim, EMBEDDING_DTYPE)
+        return _store
+
+def warmup():
+    get_store()
 
 # Парсер характеристик (сохранил из старого)
 _sep_re = re.compile(r'[|/\\,·•]')
@@ -56,14 +74,19 @@ def build_product_signature(row):
 def embed_products(df):
     df['parsed_features'] = df['характеристики'].apply(fast_parse_features)
     signatures = df.apply(build_product_signature, axis=1).tolist()
-    embeddings = MODEL.encode(signatures, batch_size=32, convert_to_numpy=True, normalize_embeddings=True)
-    return embeddings, df
+    store = get_store()
+    return store.take(store.embed(signatures, encode_signatures)), df
+
+def encode_signatures(signatures: List[str]) -> np.ndarray:
+    return get_model(MODEL_NAME).encode(signatures, batch_size=32, convert_to_numpy=True, normalize_embeddings=True)
 
-def aggregate_df(df: pd.DataFrame, strictness: float = 0.7) -> Dict[str, List[int]]:
+def aggregate_df(df: pd.DataFrame, strictness: float = 0.7, preprocess: bool = True) -> Dict[str, List[int]]:
+    # preprocess=False — df уже нормализован (товары из БД, см. engines.run_engine)
     if df.empty:
         return {}
-    from .preprocessor import preprocess_and_normalize
-    df, _ = preprocess_and_normalize(df)
+    if preprocess:
+        from .preprocessor import preprocess_and_normalize
+        df, _ = preprocess_and_normalize(df)
     embeddings, df = embed_products(df)
     distance_threshold = 1 - strictness  # strictness 0.7 → threshold 0.3
     clustering = AgglomerativeClustering(
@@ -90,8 +113,10 @@ def aggregate_df(df: pd.DataFrame, strictness: float = 0.7) -> Dict[str, List[in
 
 def find_closest_group(new_product: dict, existing_embeddings: np.ndarray, existing_groups: Dict[str, List[int]], threshold=0.8):
     new_sig = build_product_signature(new_product)
-    new_emb = MODEL.encode([new_sig], convert_to_numpy=True, normalize_embeddings=True)[0]
-    similarities = cosine_similarity([new_emb], existing_embeddings)[0]
+    store = get_store()
+    new_emb = store.take(store.embed([new_sig], encode_signatures))[0].astype(np.float32)
+    # Векторы нормированы: косинус — скалярное произведение, memmap читается без копии
+    similarities = existing_embeddings @ new_emb
     max_sim = np.max(similarities)
     if max_sim >= threshold:
         closest_idx = np.argmax(similarities)
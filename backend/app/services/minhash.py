@@ -0,0 +1,83 @@
+# backend/app/services/minhash.py
+import zlib
+import numpy as np
+from typing import Dict, List, Set, Tuple
+
+# Простое число Мерсенна 2^31 - 1: a * x < 2^62 помещается в uint64
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+def shingles(text: str, size: int = 3) -> Set[str]:
+    """Символьные шинглы длины size (короткая строка — сама себе шингл)"""
+    if not text:
+        return set()
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def lsh_params(strictness: float, num_perm: int = 128) -> Tuple[int, int]:
+    """Число полос и строк в полосе для заданной строгости.
+
+    Пара становится кандидатом с вероятностью 1 - (1 - J^rows)^bands, порог
+    этой S-кривой ≈ (1/bands)^(1/rows). Целевой порог по Жаккару растёт со
+    строгостью (0.3 при 0, 0.8 при 1); из делителей num_perm берётся
+    разбиение с ближайшим порогом.
+    """
+    target = 0.3 + 0.5 * strictness
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - target)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class MinHashLSH:
+    """MinHash-сигнатуры по символьным шинглам и LSH-бакетирование полосами"""
+
+    def __init__(self, bands: int, rows: int, shingle_size: int = 3, seed: int = 1):
+        self.bands = bands
+        self.rows = rows
+        self.num_perm = bands * rows
+        self.shingle_size = shingle_size
+        # Универсальное хеширование h(x) = (a * x + b) mod p
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, MERSENNE_PRIME, size=self.num_perm).astype(np.uint64)
+        self.b = rng.randint(0, MERSENNE_PRIME, size=self.num_perm).astype(np.uint64)
+
+    @classmethod
+    def for_strictness(cls, strictness: float, num_perm: int = 128, **kwargs) -> "MinHashLSH":
+        bands, rows = lsh_params(strictness, num_perm)
+        return cls(bands, rows, **kwargs)
+
+    def signatures(self, texts: List[str]) -> np.ndarray:
+        """Матрица MinHash (len(texts) × num_perm); у текста без шинглов все значения равны p"""
+        result = np.full((len(texts), self.num_perm), MERSENNE_PRIME, dtype=np.uint64)
+        for i, text in enumerate(texts):
+            items = shingles(text, self.shingle_size)
+            if not items:
+                continue
+            # crc32 стабилен между процессами, в отличие от hash()
+            x = np.fromiter((zlib.crc32(s.encode()) for s in items), dtype=np.uint64, count=len(items))
+            x %= MERSENNE_PRIME
+            result[i] = ((np.outer(self.a, x) + self.b[:, None]) % MERSENNE_PRIME).min(axis=1)
+        return result
+
+    def candidate_pairs(self, signatures: np.ndarray) -> Set[Tuple[int, int]]:
+        """Пары (i, j), i < j, совпавшие хотя бы в одной полосе"""
+        nonempty = np.flatnonzero((signatures != MERSENNE_PRIME).any(axis=1))
+        pairs: Set[Tuple[int, int]] = set()
+        for band in range(self.bands):
+            chunk = signatures[nonempty, band * self.rows:(band + 1) * self.rows]
+            buckets: Dict[bytes, List[int]] = {}
+            for i, row in zip(nonempty, chunk):
+                buckets.setdefault(row.tobytes(), []).append(int(i))
+            for members in buckets.values():
+                for k, i in enumerate(members):
+                    for j in members[k + 1:]:
+                        pairs.add((i, j))
+        return pairs
@@ -27,6 +27,11 @@ def normalize_brand(brand: str) -> str:
             return correct
     return brand.strip().title()
 
+def normalize_characteristic_key(key: str) -> str:
+    key = key.strip().lower()
+    key = re.sub(r'\s+', ' ', key)
+    return key.replace(' ', '_').replace('-', '_').replace('(', '').replace(')', '')
+
 def parse_characteristics(raw: str) -> Dict[str, str]:
     if pd.isna(raw) or not raw:
         return {}
@@ -36,14 +41,28 @@ def parse_characteristics(raw: str) -> Dict[str, str]:
         if ':' not in part:
             continue
         key, val = part.split(':', 1)
-        key = key.strip().lower()
         # Нормализация ключей
-        key = re.sub(r'\s+', ' ', key)
-        key = key.replace(' ', '_').replace('-', '_').replace('(', '').replace(')', '')
+        key = normalize_characteristic_key(key)
         val = val.strip()
         result[key] = val
     return result
 
+_leading_number_re = re.compile(r'^\s*([-+]?\d+(?:[.,]\d+)?)')
+
+def parse_numeric(value: str) -> Optional[float]:
+    """Число в начале значения характеристики ("215 мм" -> 215.0)"""
+    if not value:
+        return None
+    match = _leading_number_re.match(str(value))
+    return float(match.group(1).replace(',', '.')) if match else None
+
+def attribute_rows(product_id: int, raw: str) -> List[Tuple[int, str, str, Optional[float]]]:
+    """Строки таблицы product_attributes для одного товара"""
+    return [
+        (product_id, key, val, parse_numeric(val))
+        for key, val in parse_characteristics(raw).items()
+    ]
+
 def extract_model_from_name(name: str) -> Optional[str]:
     if not name:
         return None
@@ -78,9 +97,13 @@ def detect_column_shift(df: pd.DataFrame) -> List[int]:
             shifted.append(idx)
     return shifted
 
-def preprocess_and_normalize(df: pd.DataFrame) -> Tuple[pd.DataFrame, List[str]]:
+def preprocess_and_normalize(df: pd.DataFrame, summary: bool = True) -> Tuple[pd.DataFrame, List[str]]:
+    # summary=False — без итоговой строки «Обработано»: её пишет вызывающий код,
+    # который обрабатывает файл чанками (api/upload.py)
     warnings_list = []
     original_len = len(df)
+    if df.empty:
+        return df, warnings_list
 
     shifted_rows = detect_column_shift(df)
     if len(shifted_rows) == len(df):
@@ -111,9 +134,10 @@ def preprocess_and_normalize(df: pd.DataFrame) -> Tuple[pd.DataFrame, List[str]]
             if not val: return None
             match = re.search(r'[\d\.]+', str(val))
             return float(match.group()) if match else None
-        if key in df['characteristics_norm'].iloc[0]:
+        if not df.empty and key in df['characteristics_norm'].iloc[0]:
             df[f'char_{key}'] = df['characteristics_norm'].apply(lambda x: extract_num(x.get(key)))
     # 7. Удаляем полностью пустые строки
     df = df.dropna(subset=['id сте', 'название сте'], how='all')
-    warnings_list.append(f"Обработано: {original_len} → {len(df)} строк (-{original_len - len(df)})")
+    if summary:
+        warnings_list.append(f"Обработано: {original_len} → {len(df)} строк (-{original_len - len(df)})")
     return df, warnings_list
\ No newline at end of file
@@ -1,210 +1,624 @@
 # backend/app/services/storage.py
+import copy
 import sqlite3
+from contextlib import contextmanager
 from pathlib import Path
+import numpy as np
 import pandas as pd
+import base64
 import json
-from typing import Dict, List, Optional, Any
+import re
+import threading
+import uuid
+from typing import Callable, Dict, List, Optional, Any, Sequence
 from app.models.product import Product
 from app.models.group import ProductGroup
-from app.services.grouping_core import aggregate_df
+from app.services.preprocessor import attribute_rows, normalize_characteristic_key, parse_numeric
+from app.core.config import (
+    DB_POOL_SIZE, DB_BUSY_TIMEOUT, GROUP_PREVIEW_SIZE, CACHE_SIZE, CACHE_TTL,
+    GROUP_INDEX_DIM, GROUP_INDEX_NPROBE, GROUP_INDEX_THRESHOLD,
+)
+from app.core.db import ConnectionPool
+from app.services.cache import LRUCache
+from app.services.group_index import GroupIndex, product_text
+from app.core.migrations import migrate, product_facets_sql, REBUILD_FACETS_SQL
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+# Колонки исходного файла в порядке полей INSERT INTO products
+PRODUCT_SOURCE_COLUMNS = (
+    'id сте',
+    'название сте',
+    'модель',
+    'производитель',
+    'страна происхождения',
+    'id категории',
+    'название категории',
+    'ссылка на картинку сте',
+    'характеристики',
+)
+INSERT_CHUNK_SIZE = 5000
+INSERT_ATTRIBUTES_SQL = (
+    'INSERT INTO product_attributes (product_id, key, value, numeric_value) VALUES (?, ?, ?, ?)'
+)
+# Поля products, от которых зависит сигнатура группировки
+SIGNATURE_SOURCE_COLUMNS = ['name', 'model', 'manufacturer', 'category_name', 'characteristics']
+
 class Storage:
-    def __init__(self):
-        self.db_path = Path('data/catalog.db')
+    def __init__(self, db_path: Path = Path('data/catalog.db'),
+                 pool_size: int = DB_POOL_SIZE, busy_timeout: float = DB_BUSY_TIMEOUT):
+        self.db_path = Path(db_path)
         self.db_path.parent.mkdir(exist_ok=True)
-        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        self.cursor = self.conn.cursor()
+        # Каждый вызов берёт своё соединение из пула: курсоры не делятся между потоками
+        self.pool = ConnectionPool(self.db_path, size=pool_size, busy_timeout=busy_timeout)
+        # Read-through кэш карточек группы и товара; записи инвалидируют его после commit
+        self.group_cache = LRUCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+        self.product_cache = LRUCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+        # ANN-индекс центроидов групп для новых товаров: строится при первом обращении,
+        # сбрасывается вместе с кэшами после массовых записей
+        self.group_index_dir = self.db_path.parent / 'group_index'
+        self._group_index: Optional[GroupIndex] = None
+        self._group_index_lock = threading.Lock()
         self._init_db()
 
+    def connection(self):
+        """Соединение из пула на время блока with (только чтение)"""
+        return self.pool.connection()
+
     def _init_db(self):
-        # Таблица продуктов (существующая)
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            original_id TEXT,
-            name TEXT,
-            model TEXT,
-            manufacturer TEXT,
-            country TEXT,
-            category_id TEXT,
-            category_name TEXT,
-            image_url TEXT,
-            characteristics TEXT,
-            group_id TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
-    
-        # Таблица групп (существующая)
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS groups (
-            group_id TEXT PRIMARY KEY,
-            name TEXT,
-            representative_id INTEGER,
-            product_count INTEGER DEFAULT 0,
-            score REAL DEFAULT 0.0,
-            user_score INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (representative_id) REFERENCES products (id)
-        )''')
-    
-        # Добавьте эту таблицу для групповых атрибутов
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS group_attributes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            group_id TEXT,
-            attribute_name TEXT,
-            attribute_value TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (group_id) REFERENCES groups (group_id)
-        )''')
-    
-        self.conn.commit()
-
-    def add_products(self, df: pd.DataFrame):
-        """Добавление продуктов в БД"""
-        self.clear()
-        
-        for _, row in df.iterrows():
-            self.cursor.execute('''
-            INSERT INTO products 
-            (original_id, name, model, manufacturer, country, category_id, category_name, image_url, characteristics)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                str(row.get('id сте', '')),
-                str(row.get('название сте', '')),
-                str(row.get('модель', '')),
-                str(row.get('производитель', '')),
-                str(row.get('страна происхождения', '')),
-                str(row.get('id категории', '')),
-                str(row.get('название категории', '')),
-                str(row.get('ссылка на картинку сте', '')),
-                str(row.get('характеристики', ''))
-            ))
-        self.conn.commit()
-        logger.info(f"Added {len(df)} products to database")
-
-    def apply_groups(self, groups: Dict[str, List[int]]):
-        """Применение групп к продуктам в БД"""
-        # Очистка старых групп
-        self.cursor.execute('DELETE FROM groups')
-        self.cursor.execute('UPDATE products SET group_id = NULL')
-        
-        # Создание новых групп
+        """Применение миграций схемы (планы горячих запросов проверяет tests/test_query_plans.py)"""
+        with self.pool.connection() as conn:
+            version = migrate(conn)
+        logger.info(f"catalog.db schema version {version}")
+
+    def _invalidate_caches(self):
+        """Сброс кэшей групп и товаров после массовых записей"""
+        self.group_cache.clear()
+        self.product_cache.clear()
+
+    def _invalidate_all(self):
+        """Сброс кэшей и индекса групп (каталог очищен или заменён)"""
+        self._invalidate_caches()
+        # Ждёт идущего построения индекса, поэтому построенный по старым данным индекс не переживёт сброса
+        with self._group_index_lock:
+            self._group_index = None
+            GroupIndex.drop(self.group_index_dir)
+
+    def _rebuild_group_index(self):
+        """Сброс индекса групп и его построение в фоновом потоке (группы пересчитаны целиком).
+
+        Запрос, которому индекс нужен раньше, ждёт построения на блокировке,
+        а не строит его сам по второму кругу.
+        """
+        self._invalidate_all()
+        threading.Thread(target=self.group_index, name='group-index', daemon=True).start()
+
+    def group_index(self) -> GroupIndex:
+        """ANN-индекс центроидов групп: с диска, а если его нет — по текущим группам"""
+        with self._group_index_lock:
+            if self._group_index is None:
+                started = time.time()
+                index = GroupIndex.load(self.group_index_dir, GROUP_INDEX_DIM, GROUP_INDEX_NPROBE)
+                if index is None:
+                    with self.pool.connection() as conn:
+                        rows = conn.execute('''
+                        SELECT name, model, manufacturer, category_name, group_id
+                        FROM products WHERE group_id IS NOT NULL
+                        ''').fetchall()
+                    index = GroupIndex.build(
+                        [product_text(*row[:3]) for row in rows], [row[4] for row in rows],
+                        [row[3] for row in rows], GROUP_INDEX_DIM, GROUP_INDEX_NPROBE,
+                    )
+                    index.save(self.group_index_dir)
+                logger.info(f"Group index ready: {len(index)} groups in {time.time() - started:.2f}s")
+                self._group_index = index
+            return self._group_index
+
+    def _update_group_index(self, update: Callable[[GroupIndex], None]):
+        """Правка загруженного индекса групп после commit ручного изменения.
+
+        Если индекс ещё не загружен, сохранённый на диске устарел — он
+        удаляется и при следующем обращении строится по БД заново.
+        Используется и массовыми записями по части каталога (срез,
+        переагрегация групп): их товары переносятся в индексе по одному.
+        """
+        with self._group_index_lock:
+            index = self._group_index
+            if index is None:
+                GroupIndex.drop(self.group_index_dir)
+                return
+        update(index)
+
+    def _index_rows(self, conn: sqlite3.Connection, products_sql: str, params: Sequence) -> List[tuple]:
+        """(id, текст для индекса, категория, group_id) товаров из подзапроса products_sql — снимок до записи"""
+        rows = conn.execute(
+            f'SELECT id, name, model, manufacturer, category_name, group_id FROM products WHERE id IN ({products_sql})',
+            list(params)
+        )
+        return [(row[0], product_text(*row[1:4]), row[4] or '', row[5]) for row in rows]
+
+    def add_products(self, df: pd.DataFrame, chunk_size: int = INSERT_CHUNK_SIZE, replace: bool = True) -> List[int]:
+        """Добавление продуктов в БД пакетной вставкой.
+
+        Кортежи строк собираются поколоночно, вставка идёт через executemany
+        чанками по chunk_size строк, каждый чанк — в своей транзакции.
+        replace=True сначала очищает каталог; потоковая загрузка передаёт
+        False и заменяет каталог через catalog_replacement.
+        Возвращает id новых продуктов в порядке строк df.
+        """
+        if replace:
+            self.clear()
+
+        started = time.perf_counter()
+        columns = [
+            df[col].map(str).tolist() if col in df.columns else [''] * len(df)
+            for col in PRODUCT_SOURCE_COLUMNS
+        ]
+        rows = list(zip(*columns))
+
+        ids: List[int] = []
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            # Каждый чанк — отдельная транзакция: commit при успехе, rollback при ошибке
+            with self.pool.transaction() as conn:
+                conn.executemany('''
+                INSERT INTO products 
+                (original_id, name, model, manufacturer, country, category_id, category_name, image_url, characteristics)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', chunk)
+                # Внутри одной транзакции AUTOINCREMENT выдаёт id подряд
+                last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+                chunk_ids = range(last_id - len(chunk) + 1, last_id + 1)
+                # Характеристики нормализуются один раз — при загрузке
+                conn.executemany(
+                    INSERT_ATTRIBUTES_SQL,
+                    [attr for product_id, row in zip(chunk_ids, chunk) for attr in attribute_rows(product_id, row[-1])]
+                )
+            ids.extend(chunk_ids)
+        # Новые товары без групп: индекс групп не меняется
+        self._invalidate_caches()
+
+        elapsed = time.perf_counter() - started
+        rate = len(rows) / elapsed if elapsed > 0 else float(len(rows))
+        logger.info(f"Added {len(rows)} products to database in {elapsed:.2f}s ({rate:.0f} rows/sec)")
+        return ids
+
+    def apply_groups(self, groups: Dict[str, List[int]], product_ids: Optional[Sequence[int]] = None,
+                     scores: Optional[Dict[str, float]] = None):
+        """Применение групп к продуктам в БД.
+
+        groups содержит позиции строк DataFrame, product_ids — отображение
+        позиция -> id продукта (например, результат add_products или df['id']).
+        Без product_ids позиции соответствуют порядку id в таблице products.
+        scores — автоматическая оценка групп 0-100 (EngineResult.scores).
+        Вся запись выполняется одной транзакцией через временную таблицу.
+        """
+        scores = scores or {}
+        if product_ids is None:
+            with self.pool.connection() as conn:
+                product_ids = [row[0] for row in conn.execute('SELECT id FROM products ORDER BY id')]
+
+        group_rows = []
+        membership = []
         for gid, indices in groups.items():
-            if not indices:
-                continue
-                
-            # Получаем первый продукт как представителя
-            first_idx = indices[0]
-            product = self.get_product_by_index(first_idx)
-            if not product:
+            ids = [int(product_ids[idx]) for idx in indices if 0 <= idx < len(product_ids)]
+            if not ids:
                 continue
-                
-            rep_id = product['id']
-            name = product['name']
-            
-            # Создаем группу
-            self.cursor.execute(
-                'INSERT INTO groups (group_id, name, representative_id, product_count) VALUES (?, ?, ?, ?)',
-                (gid, name, rep_id, len(indices))
+            # Первый продукт группы — представитель
+            group_rows.append((gid, len(ids), scores.get(gid, 0.0), ids[0]))
+            membership.extend((product_id, gid) for product_id in ids)
+
+        with self.pool.transaction() as conn:
+            # Очистка старых групп
+            conn.execute('DELETE FROM groups')
+            conn.execute('UPDATE products SET group_id = NULL')
+
+            conn.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS group_membership (product_id INTEGER PRIMARY KEY, group_id TEXT)'
             )
-            
-            # Обновляем продукты
-            for idx in indices:
-                product = self.get_product_by_index(idx)
-                if product:
-                    self.cursor.execute(
-                        'UPDATE products SET group_id = ? WHERE id = ?',
-                        (gid, product['id'])
-                    )
-        
-        self.conn.commit()
-        logger.info(f"Applied {len(groups)} groups to database")
+            conn.execute('DELETE FROM temp.group_membership')
+            conn.executemany(
+                'INSERT OR REPLACE INTO temp.group_membership (product_id, group_id) VALUES (?, ?)',
+                membership
+            )
+
+            # Создание новых групп: имя берём у представителя
+            conn.executemany('''
+            INSERT INTO groups (group_id, name, representative_id, product_count, score)
+            SELECT ?, name, id, ?, ? FROM products WHERE id = ?
+            ''', group_rows)
+
+            # Обновляем продукты одним запросом
+            conn.execute('''
+            UPDATE products SET group_id = (
+                SELECT m.group_id FROM temp.group_membership m WHERE m.product_id = products.id
+            )
+            WHERE id IN (SELECT product_id FROM temp.group_membership)
+            ''')
+            conn.execute('DELETE FROM temp.group_membership')
+
+            # Состав групп поменялся целиком — фасеты пересчитываем одним запросом
+            conn.execute('DELETE FROM facet_counts')
+            conn.execute(REBUILD_FACETS_SQL)
+        self._rebuild_group_index()
+
+        logger.info(f"Applied {len(group_rows)} groups to database")
+
+    def apply_slice_groups(self, groups: Dict[str, List[int]], product_ids: Sequence[int],
+                           scores: Optional[Dict[str, float]] = None):
+        """Применение групп только к товарам среза (остальные группы не трогаются).
+
+        id движка (grp_N, single_N, ...) получают уникальный префикс, чтобы
+        не совпасть с группами каталога. Возвращает id созданных групп.
+        """
+        scores = scores or {}
+        prefix = f"s{uuid.uuid4().hex[:8]}_"
+        placeholders = ','.join('?' for _ in product_ids)
+        created = []
+        targets = {}
+        with self.pool.transaction() as conn, \
+                self._facets_tracked(conn, f'SELECT id FROM products WHERE id IN ({placeholders})', list(product_ids)):
+            index_rows = self._index_rows(conn, placeholders, product_ids)
+            for gid, idxs in groups.items():
+                ids = [int(product_ids[i]) for i in idxs]
+                conn.execute('''
+                INSERT INTO groups (group_id, name, representative_id, product_count, score)
+                SELECT ?, name, id, ?, ? FROM products WHERE id = ?
+                ''', (prefix + gid, len(ids), scores.get(gid, 0.0), ids[0]))
+                conn.executemany(
+                    "UPDATE products SET group_id = ? WHERE id = ?",
+                    [(prefix + gid, product_id) for product_id in ids]
+                )
+                created.append(prefix + gid)
+                targets.update((product_id, prefix + gid) for product_id in ids)
+        self._invalidate_caches()
+        self._update_group_index(lambda index: _reindex_products(index, index_rows, targets))
+        return created
+
+    def _recount_groups(self, conn: sqlite3.Connection, group_ids: Sequence[str]):
+        """Пересчёт product_count у групп group_ids по таблице products"""
+        conn.executemany(
+            'UPDATE groups SET product_count = (SELECT COUNT(*) FROM products WHERE group_id = ?) WHERE group_id = ?',
+            [(gid, gid) for gid in group_ids]
+        )
 
     def get_product_by_index(self, idx: int) -> Optional[Dict]:
         """Получить продукт по индексу (для совместимости)"""
-        self.cursor.execute('SELECT * FROM products LIMIT 1 OFFSET ?', (idx,))
-        row = self.cursor.fetchone()
-        if not row:
+        with self.pool.connection() as conn:
+            cursor = conn.execute('SELECT * FROM products LIMIT 1 OFFSET ?', (idx,))
+            return _fetch_dict(cursor)
+
+    def get_product(self, product_id: int) -> Optional[Dict]:
+        """Получить продукт по id вместе с разобранными характеристиками (через кэш)"""
+        product = self.product_cache.get_or_load(product_id, lambda: self._load_product(product_id))
+        if product is None:
             return None
-            
-        columns = [desc[0] for desc in self.cursor.description]
-        return dict(zip(columns, row))
+        # Копия: вызывающий код может менять словарь, кэш при этом не портится
+        return {**product, 'characteristics_dict': dict(product['characteristics_dict'])}
+
+    def _load_product(self, product_id: int) -> Optional[Dict]:
+        with self.pool.connection() as conn:
+            product = _fetch_dict(conn.execute('SELECT * FROM products WHERE id = ?', (product_id,)))
+        if product:
+            product['characteristics_dict'] = _characteristics_dict(product.get('characteristics'))
+        return product
 
     def get_all_products_df(self) -> pd.DataFrame:
         """Получить все продукты как DataFrame"""
-        return pd.read_sql('SELECT * FROM products', self.conn)
+        with self.pool.connection() as conn:
+            return pd.read_sql('SELECT * FROM products', conn)
+
+    def get_products_df(self, product_ids: Sequence[int]) -> pd.DataFrame:
+        """Получить выбранные продукты как DataFrame"""
+        placeholders = ','.join('?' for _ in product_ids)
+        with self.pool.connection() as conn:
+            return pd.read_sql(
+                f'SELECT * FROM products WHERE id IN ({placeholders})', conn, params=list(product_ids)
+            )
+
+    def get_group_products_df(self, group_ids: Sequence[str]) -> pd.DataFrame:
+        """Товары групп group_ids как DataFrame"""
+        placeholders = ','.join('?' for _ in group_ids)
+        with self.pool.connection() as conn:
+            return pd.read_sql(
+                f'SELECT * FROM products WHERE group_id IN ({placeholders}) ORDER BY id', conn, params=list(group_ids)
+            )
+
+    def get_category_products_df(self, categories: Sequence[Optional[str]]) -> pd.DataFrame:
+        """Товары категорий categories (None — товары без категории) как DataFrame"""
+        names = [c for c in categories if c is not None]
+        conditions = [f"category_name IN ({','.join('?' for _ in names)})"]
+        if len(names) < len(categories):
+            conditions.append('category_name IS NULL')
+        with self.pool.connection() as conn:
+            # Порядок как у get_all_products_df: от него зависят ключи кэша TF-IDF блоков
+            return pd.read_sql(
+                f'SELECT * FROM products WHERE {" OR ".join(conditions)} ORDER BY id', conn, params=names
+            )
+
+    def get_category_names(self, group_ids: Optional[Sequence[str]] = None) -> List[Optional[str]]:
+        """Различные category_name товаров групп group_ids, без них — всего каталога"""
+        with self.pool.connection() as conn:
+            if group_ids is not None:
+                placeholders = ','.join('?' for _ in group_ids)
+                rows = conn.execute(
+                    f'SELECT DISTINCT category_name FROM products WHERE group_id IN ({placeholders})', list(group_ids)
+                ).fetchall()
+                return [row[0] for row in rows]
+            # Переход к следующему значению по индексу: категорий мало, индекс целиком не читается
+            rows = conn.execute('''
+            WITH RECURSIVE names (name) AS (
+                SELECT MIN(category_name) FROM products
+                UNION ALL
+                SELECT (SELECT MIN(category_name) FROM products WHERE category_name > names.name)
+                FROM names WHERE names.name IS NOT NULL
+            )
+            SELECT name FROM names WHERE name IS NOT NULL
+            ''').fetchall()
+            has_null = conn.execute('SELECT 1 FROM products WHERE category_name IS NULL LIMIT 1').fetchone()
+        return [row[0] for row in rows] + ([None] if has_null else [])
+
+    def ensure_signatures(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Признаки и сигнатуры товаров df (результат get_*_df) через кэш product_signatures.
+
+        Пересчитываются только товары, у которых изменился хеш исходных полей;
+        для неизменного каталога этап признаков целиком пропускается.
+        Возвращает DataFrame как ProductGrouper.build_signatures, по позициям df.
+        """
+        # Импорт здесь: grouping_core тянет sklearn и scipy, а остальному хранилищу они не нужны
+        from app.services.grouping_core import ProductGrouper, PRIORITY_FIELDS, SIGNATURE_HASH_KEY
+
+        columns = PRIORITY_FIELDS + ['signature']
+        if df.empty:
+            return pd.DataFrame(columns=columns)
+
+        hashes = pd.util.hash_pandas_object(
+            df[SIGNATURE_SOURCE_COLUMNS], index=False, hash_key=SIGNATURE_HASH_KEY
+        ).map('{:016x}'.format).to_numpy()
+        with self.pool.connection() as conn:
+            # Только строки товаров df: срез из 50 товаров не читает кэш всего каталога
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS signature_ids (product_id INTEGER PRIMARY KEY)')
+            conn.execute('DELETE FROM temp.signature_ids')
+            conn.executemany(
+                'INSERT OR IGNORE INTO temp.signature_ids (product_id) VALUES (?)', ((int(i),) for i in df['id'])
+            )
+            cached = pd.read_sql(f'''
+            SELECT s.product_id, s.content_hash, {", ".join('s.' + c for c in columns)}
+            FROM temp.signature_ids JOIN product_signatures s ON s.product_id = signature_ids.product_id
+            ''', conn)
+            conn.execute('DELETE FROM temp.signature_ids')
+        cached = cached.set_index('product_id').reindex(df['id'].to_numpy())
+        stale = cached['content_hash'].to_numpy() != hashes
+
+        features = cached[columns].reset_index(drop=True).astype(object)
+        if stale.any():
+            fresh = ProductGrouper().build_signatures(df[stale])
+            features.loc[stale, columns] = fresh[columns].to_numpy()
+            rows = zip(df['id'][stale].tolist(), hashes[stale].tolist(), *(fresh[c].tolist() for c in columns))
+            with self.pool.transaction() as conn:
+                conn.executemany(f'''
+                INSERT OR REPLACE INTO product_signatures (product_id, content_hash, {", ".join(columns)})
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', list(rows))
+        logger.info(f"Signatures: {int(stale.sum())} of {len(df)} products recomputed")
+        return features
+
+    def get_low_rated_group_ids(self, threshold: int = 3) -> List[str]:
+        """Группы с оценкой модератора ниже threshold"""
+        with self.pool.connection() as conn:
+            rows = conn.execute('SELECT group_id FROM groups WHERE user_score < ?', (threshold,)).fetchall()
+        return [row[0] for row in rows]
+
+    def get_protected_group_ids(self, threshold: int = 3) -> List[str]:
+        """Группы, одобренные модератором (оценка не ниже threshold): переагрегация их не трогает"""
+        with self.pool.connection() as conn:
+            rows = conn.execute('SELECT group_id FROM groups WHERE user_score >= ?', (threshold,)).fetchall()
+        return [row[0] for row in rows]
+
+    def replace_groups(self, old_group_ids: Sequence[str], groups: Dict[str, List[int]],
+                       product_ids: Sequence[int]) -> List[str]:
+        """Замена групп old_group_ids новыми группами; остальные группы не трогаются.
+
+        groups содержит позиции в product_ids (как результат aggregate_df по
+        срезу). id новых групп получают уникальный префикс, чтобы не
+        пересечься с существующими grp_N. Возвращает id новых групп.
+        """
+        prefix = f"r{uuid.uuid4().hex[:8]}_"
+        group_rows = []
+        membership = []
+        for gid, indices in groups.items():
+            ids = [int(product_ids[idx]) for idx in indices]
+            if not ids:
+                continue
+            group_rows.append((prefix + gid, len(ids), ids[0]))
+            membership.extend((product_id, prefix + gid) for product_id in ids)
+
+        with self.pool.transaction() as conn:
+            conn.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS group_membership (product_id INTEGER PRIMARY KEY, group_id TEXT)'
+            )
+            conn.execute('DELETE FROM temp.group_membership')
+            conn.executemany(
+                'INSERT OR REPLACE INTO temp.group_membership (product_id, group_id) VALUES (?, ?)',
+                membership
+            )
+            index_rows = self._index_rows(conn, 'SELECT product_id FROM temp.group_membership', ())
+            with self._facets_tracked(conn, 'SELECT product_id FROM temp.group_membership', ()):
+                conn.executemany('DELETE FROM group_attributes WHERE group_id = ?', [(g,) for g in old_group_ids])
+                conn.executemany('DELETE FROM groups WHERE group_id = ?', [(g,) for g in old_group_ids])
+                conn.executemany('''
+                INSERT INTO groups (group_id, name, representative_id, product_count)
+                SELECT ?, name, id, ? FROM products WHERE id = ?
+                ''', group_rows)
+                conn.execute('''
+                UPDATE products SET group_id = (
+                    SELECT m.group_id FROM temp.group_membership m WHERE m.product_id = products.id
+                )
+                WHERE id IN (SELECT product_id FROM temp.group_membership)
+                ''')
+            conn.execute('DELETE FROM temp.group_membership')
+        self._invalidate_caches()
+        targets = dict(membership)
+        self._update_group_index(lambda index: _reindex_products(index, index_rows, targets, old_group_ids))
+
+        logger.info(f"Replaced {len(old_group_ids)} groups with {len(group_rows)} groups")
+        return [row[0] for row in group_rows]
+
+    def ungroup_products(self, product_ids: Sequence[int]):
+        """Снять group_id у выбранных продуктов"""
+        placeholders = ','.join('?' for _ in product_ids)
+        with self.pool.transaction() as conn, \
+                self._facets_tracked(conn, f'SELECT id FROM products WHERE id IN ({placeholders})', list(product_ids)):
+            index_rows = self._index_rows(conn, placeholders, product_ids)
+            source_groups = {row[3] for row in index_rows if row[3]}
+            conn.execute(
+                f'UPDATE products SET group_id = NULL WHERE id IN ({placeholders})', list(product_ids)
+            )
+            # У исходных групп остались только не попавшие в срез товары
+            self._recount_groups(conn, list(source_groups))
+        self._invalidate_caches()
+        self._update_group_index(lambda index: _reindex_products(index, index_rows, {}))
 
     def search_groups(self, query: str = None, category: str = None,
-                    filters: dict = None, offset: int = 0, limit: int = 20):
+                    filters: dict = None, offset: int = 0, limit: int = 20,
+                    preview_size: int = GROUP_PREVIEW_SIZE, after: Optional[str] = None):
+        """Страница групп вместе с превью товаров (до preview_size на группу) одним запросом.
 
-        try:
-            sql = """
-                SELECT DISTINCT g.group_id, g.name, g.product_count, g.created_at
-                FROM groups g
-                LEFT JOIN products p ON g.group_id = p.group_id
-                WHERE 1=1
-            """
+        after — курсор из поля cursor последней группы предыдущей страницы
+        (keyset-пагинация); offset оставлен для обратной совместимости.
+        ValueError, если курсор не разобран или выдан для поиска с query
+        (без query), а запрошен без него (с ним).
+        """
+        # Полнотекстовый поиск по товарам (FTS5, ранжирование BM25)
+        match = _fts_query(query) if query and query.strip() else None
+        position = _decode_cursor(after, ranked=bool(match)) if after else None
 
+        try:
+            joins = []
+            where = []
             params = []
 
-            # Поиск по названию группы или товара
-            if query:
-                sql += " AND (g.name LIKE ? OR p.name LIKE ?)"
-                q = f"%{query}%"
-                params.extend([q, q])
+            if query and query.strip() and not match:
+                return []
+            if match:
+                joins.append("JOIN products_fts f ON f.rowid = p.id")
+                where.append("products_fts MATCH ?")
+                params.append(match)
 
-            # Поиск по категории (в таблице products)
+            # Категория — точное значение фасета (индекс idx_products_category_name)
             if category:
-                sql += " AND p.category_name LIKE ?"
-                params.append(f"%{category}%")
+                where.append("p.category_name = ?")
+                params.append(category)
 
             # Дополнительные фильтры
             if filters:
                 for key, value in filters.items():
                     # фильтруем только поля таблицы groups или products
-                    if key in ["name", "category_name", "manufacturer", "model"]:
-                        sql += f" AND p.{key} LIKE ?"
-                        params.append(f"%{value}%")
+                    if key in ["category_name", "manufacturer"]:
+                        where.append(f"p.{key} = ?")
+                        params.append(value)
+                    elif key in ["name", "model"]:
+                        # Подстрочный LIKE читал бы всю таблицу: ищем по словам в колонке FTS
+                        column_match = _fts_query(value)
+                        if not column_match:
+                            return []
+                        where.append("p.id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)")
+                        params.append(f"{key} : ({column_match})")
                     elif key in ["product_count"]:
-                        sql += f" AND g.{key} = ?"
+                        where.append(f"g.{key} = ?")
                         params.append(value)
+                    else:
+                        # Любой другой ключ — характеристика товара (индекс по product_attributes)
+                        attr_key = normalize_characteristic_key(key)
+                        subquery = "SELECT product_id FROM product_attributes WHERE key = ? AND value = ?"
+                        attr_params = [attr_key, value]
+                        number = parse_numeric(value)
+                        if number is not None:
+                            subquery += " UNION SELECT product_id FROM product_attributes WHERE key = ? AND numeric_value = ?"
+                            attr_params.extend([attr_key, number])
+                        where.append(f"p.id IN ({subquery})")
+                        params.extend(attr_params)
 
-            sql += " ORDER BY g.product_count DESC LIMIT ? OFFSET ?"
+            # Товары присоединяем только если по ним есть условия
+            if match or any(cond.startswith("p.") for cond in where):
+                joins.insert(0, "JOIN products p ON p.group_id = g.group_id")
+
+            # rank (bm25) меньше — релевантнее; группа ранжируется по лучшему товару
+            rank = "MIN(f.rank)" if match else "0"
+
+            page_sql = (
+                "SELECT g.group_id, g.name, g.product_count, g.created_at, "
+                f"{rank} AS rank FROM groups g"
+            )
+            if joins:
+                page_sql += " " + " ".join(joins)
+            # Keyset: продолжаем строго после позиции курсора
+            if position and not match:
+                count, group_id = position
+                where.append("g.product_count <= ? AND (g.product_count < ? OR g.group_id > ?)")
+                params.extend([count, count, group_id])
+            if where:
+                page_sql += " WHERE " + " AND ".join(where)
+            if joins:
+                page_sql += " GROUP BY g.group_id"
+            if position and match:
+                rank_after, count, group_id = position
+                page_sql += (
+                    " HAVING rank > ? OR (rank = ? AND (g.product_count < ? "
+                    "OR (g.product_count = ? AND g.group_id > ?)))"
+                )
+                params.extend([rank_after, rank_after, count, count, group_id])
+            order_keys = ["product_count DESC", "group_id"]
+            page_order = [f"g.{key}" for key in order_keys]
+            if match:
+                order_keys.insert(0, "rank")
+                page_order.insert(0, "rank")
+            page_sql += f" ORDER BY {', '.join(page_order)} LIMIT ? OFFSET ?"
             params.extend([limit, offset])
 
-            rows = self.cursor.execute(sql, params).fetchall()
+            # Страница групп и превью их товаров за один проход. LEFT JOIN от page фиксирует
+            # порядок: товары ищутся по индексу только для групп страницы
+            sql = f"""
+                WITH page AS ({page_sql}),
+                preview AS (
+                    SELECT page.group_id, page.name AS group_name, page.product_count, page.created_at, page.rank,
+                           p.id, p.name, p.category_name, p.image_url,
+                           ROW_NUMBER() OVER (PARTITION BY page.group_id ORDER BY p.id) AS rn
+                    FROM page LEFT JOIN products p ON p.group_id = page.group_id
+                )
+                SELECT group_id, group_name, product_count, created_at, rank,
+                       id, name, category_name, image_url
+                FROM preview
+                WHERE rn <= ?
+                ORDER BY {', '.join(order_keys)}, rn
+            """
+            # Первая строка нужна и при preview_size=0 — иначе группа пропадёт со страницы
+            params.append(max(preview_size, 1))
+
+            with self.pool.connection() as conn:
+                rows = conn.execute(sql, params).fetchall()
 
             result = []
             for g in rows:
-                group_id = g[0]
-
-                # Получаем продукты группы
-                products = self.cursor.execute("""
-                    SELECT id, name, category_name, image_url 
-                    FROM products 
-                    WHERE group_id = ? 
-                    LIMIT 100
-                """, (group_id,)).fetchall()
-
-                product_list = [{
-                    "product_id": p[0],
-                    "name": p[1],
-                    "category": p[2],
-                    "image_url": p[3]
-                } for p in products]
-
-                result.append({
-                    "group_id": g[0],
-                    "name": g[1],
-                    "product_count": g[2],
-                    "created_at": g[3],
-                    "products": product_list,
-                    "attributes": {}
-                })
+                if not result or result[-1]["group_id"] != g[0]:
+                    result.append({
+                        "group_id": g[0],
+                        "name": g[1],
+                        "product_count": g[2],
+                        "created_at": g[3],
+                        "products": [],
+                        "attributes": {},
+                        "cursor": _encode_cursor(g[4], g[2], g[0]) if match else _encode_cursor(g[2], g[0])
+                    })
+                if g[5] is not None and len(result[-1]["products"]) < preview_size:
+                    result[-1]["products"].append({
+                        "product_id": g[5],
+                        "name": g[6],
+                        "category": g[7],
+                        "image_url": g[8]
+                    })
 
             return result
 
@@ -213,22 +627,91 @@ class Storage:
             return []
 
 
+    def get_facets(self, query: str = None, category: str = None, limit: int = 20) -> Dict[str, Any]:
+        """Значения фасетов с количеством товаров (до limit значений на фасет).
+
+        Без query ответ строится по facet_counts и не зависит от размера каталога;
+        с query считаются только товары, найденные полнотекстовым поиском.
+        """
+        params: List[Any] = []
+        if query and query.strip():
+            match = _fts_query(query)
+            if not match:
+                return {"categories": [], "manufacturers": [], "attributes": {}}
+            condition = "p.id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)"
+            cond_params: List[Any] = [match]
+            if category:
+                condition += " AND p.category_name = ?"
+                cond_params.append(category)
+            source = f"SELECT facet, key, value, COUNT(*) AS cnt FROM ({product_facets_sql(condition)})"
+            params.extend(cond_params * 3)
+        else:
+            source = "SELECT facet, key, value, SUM(product_count) AS cnt FROM facet_counts"
+            if category:
+                source += " WHERE category_name = ?"
+                params.append(category)
+        source += " GROUP BY facet, key, value"
+
+        sql = f"""
+            SELECT facet, key, value, cnt FROM (
+                SELECT facet, key, value, cnt,
+                       ROW_NUMBER() OVER (PARTITION BY facet, key ORDER BY cnt DESC, value) AS rn
+                FROM ({source})
+            )
+            WHERE rn <= ?
+            ORDER BY facet, key, rn
+        """
+        params.append(limit)
+        with self.pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        result: Dict[str, Any] = {"categories": [], "manufacturers": [], "attributes": {}}
+        for facet, key, value, count in rows:
+            item = {"value": value, "count": count}
+            if facet == 'category_name':
+                result["categories"].append(item)
+            elif facet == 'manufacturer':
+                result["manufacturers"].append(item)
+            else:
+                result["attributes"].setdefault(key, []).append(item)
+        return result
+
+    def _adjust_facets(self, conn: sqlite3.Connection, products_sql: str, params: Sequence, sign: int):
+        """Добавить (sign=1) или вычесть (sign=-1) фасеты товаров из подзапроса products_sql"""
+        conn.execute(f'''
+        INSERT INTO facet_counts (category_name, facet, key, value, product_count)
+        SELECT category_name, facet, key, value, ? * COUNT(*)
+        FROM ({product_facets_sql(f'p.id IN ({products_sql})')})
+        GROUP BY category_name, facet, key, value
+        ON CONFLICT (category_name, facet, key, value)
+        DO UPDATE SET product_count = product_count + excluded.product_count
+        ''', (sign, *params, *params, *params))
+        conn.execute('DELETE FROM facet_counts WHERE product_count <= 0')
+
+    @contextmanager
+    def _facets_tracked(self, conn: sqlite3.Connection, products_sql: str, params: Sequence):
+        """Вычитает фасеты товаров до изменения и добавляет после — facet_counts остаётся точным"""
+        self._adjust_facets(conn, products_sql, params, -1)
+        yield
+        self._adjust_facets(conn, products_sql, params, 1)
+
     def get_group(self, group_id: str) -> Optional[ProductGroup]:
-        """Получить группу по ID"""
-        row = self.cursor.execute(
-            'SELECT * FROM groups WHERE group_id = ?', (group_id,)
-        ).fetchone()
-        
-        if not row:
-            return None
-            
-        columns = [desc[0] for desc in self.cursor.description]
-        group_dict = dict(zip(columns, row))
-        
-        # Продукты группы
-        product_rows = self.cursor.execute(
-            'SELECT id FROM products WHERE group_id = ?', (group_id,)
-        ).fetchall()
+        """Получить группу по ID (через кэш)"""
+        group = self.group_cache.get_or_load(group_id, lambda: self._load_group(group_id))
+        return copy.deepcopy(group)
+
+    def _load_group(self, group_id: str) -> Optional[ProductGroup]:
+        with self.pool.connection() as conn:
+            group_dict = _fetch_dict(conn.execute(
+                'SELECT * FROM groups WHERE group_id = ?', (group_id,)
+            ))
+            if not group_dict:
+                return None
+
+            # Продукты группы
+            product_rows = conn.execute(
+                'SELECT id FROM products WHERE group_id = ?', (group_id,)
+            ).fetchall()
         product_ids = [p[0] for p in product_rows]
         
         return ProductGroup(
@@ -243,46 +726,48 @@ class Storage:
     # Остальные методы остаются примерно такими же, но с улучшенной обработкой ошибок
     def rate_group(self, group_id: str, score: int):
         try:
-            self.cursor.execute(
-                'UPDATE groups SET user_score = ? WHERE group_id = ?',
-                (score, group_id)
-            )
-            self.conn.commit()
+            with self.pool.transaction() as conn:
+                conn.execute(
+                    'UPDATE groups SET user_score = ? WHERE group_id = ?',
+                    (score, group_id)
+                )
+            self.group_cache.invalidate(group_id)
         except Exception as e:
             logger.error(f"Error rating group {group_id}: {e}")
 
     def save_groups(self, groups: List[ProductGroup]):
         """Сохраняет группы в базу данных"""
         try:
-            for group in groups:
-                # Сохраняем группу
-                self.cursor.execute('''
-                INSERT OR REPLACE INTO groups (group_id, name, representative_id, product_count, score, user_score)
-                VALUES (?, ?, ?, ?, ?, ?)
-                ''', (
-                    group.group_id,
-                    group.name,
-                    group.representative_id,
-                    len(group.products),
-                    group.score,
-                    group.user_score
-                ))
-            
-                # Сохраняем атрибуты группы
-                for attr_name, attr_value in group.attributes.items():
-                    self.cursor.execute('''
-                    INSERT OR REPLACE INTO group_attributes (group_id, attribute_name, attribute_value)
-                    VALUES (?, ?, ?)
-                    ''', (group.group_id, attr_name, str(attr_value)))
-            
-                # Обновляем продукты с group_id
-                for product in group.products:
-                    self.cursor.execute(
-                        'UPDATE products SET group_id = ? WHERE id = ?',
-                        (group.group_id, product.id)
-                    )
-        
-            self.conn.commit()
+            with self.pool.transaction() as conn:
+                for group in groups:
+                    # Сохраняем группу
+                    conn.execute('''
+                    INSERT OR REPLACE INTO groups (group_id, name, representative_id, product_count, score, user_score)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ''', (
+                        group.group_id,
+                        group.name,
+                        group.representative_id,
+                        len(group.products),
+                        group.score,
+                        group.user_score
+                    ))
+
+                    # Сохраняем атрибуты группы
+                    for attr_name, attr_value in group.attributes.items():
+                        conn.execute('''
+                        INSERT OR REPLACE INTO group_attributes (group_id, attribute_name, attribute_value)
+                        VALUES (?, ?, ?)
+                        ''', (group.group_id, attr_name, str(attr_value)))
+
+                    # Обновляем продукты с group_id
+                    for product in group.products:
+                        conn.execute(
+                            'UPDATE products SET group_id = ? WHERE id = ?',
+                            (group.group_id, product.id)
+                        )
+
+            self._rebuild_group_index()
             logger.info(f"Saved {len(groups)} groups to database")
         
         except Exception as e:
@@ -290,101 +775,166 @@ class Storage:
             raise
     def delete_group(self, group_id: str):
         try:
-            self.cursor.execute('UPDATE products SET group_id = NULL WHERE group_id = ?', (group_id,))
-            self.cursor.execute('DELETE FROM groups WHERE group_id = ?', (group_id,))
-            self.conn.commit()
+            with self.pool.transaction() as conn, \
+                    self._facets_tracked(conn, 'SELECT id FROM products WHERE group_id = ?', (group_id,)):
+                member_ids = [row[0] for row in conn.execute(
+                    'SELECT id FROM products WHERE group_id = ?', (group_id,)
+                )]
+                conn.execute('UPDATE products SET group_id = NULL WHERE group_id = ?', (group_id,))
+                conn.execute('DELETE FROM groups WHERE group_id = ?', (group_id,))
+            self.group_cache.invalidate(group_id)
+            self.product_cache.invalidate(*member_ids)
+            # Удалённая группа не должна оставаться ближайшей для новых товаров
+            self._update_group_index(lambda index: index.remove(group_id))
         except Exception as e:
             logger.error(f"Error deleting group {group_id}: {e}")
 
+    def move_product_to_group(self, product_id: int, target_group_id: str):
+        """Переместить продукт в другую группу. KeyError, если продукта или группы нет"""
+        with self.pool.transaction() as conn:
+            row = conn.execute(
+                "SELECT group_id, name, model, manufacturer, category_name FROM products WHERE id = ?", (product_id,)
+            ).fetchone()
+            if not row:
+                raise KeyError("Product not found")
+            if not conn.execute("SELECT 1 FROM groups WHERE group_id = ?", (target_group_id,)).fetchone():
+                raise KeyError("Target group not found")
+            with self._facets_tracked(conn, 'SELECT ?', (product_id,)):
+                conn.execute(
+                    "UPDATE products SET group_id = ? WHERE id = ?",
+                    (target_group_id, product_id)
+                )
+            self._recount_groups(conn, [gid for gid in (row[0], target_group_id) if gid])
+        self.product_cache.invalidate(product_id)
+        self.group_cache.invalidate(row[0], target_group_id)
+        text = product_text(*row[1:4])
+        self._update_group_index(lambda index: _move_in_index(index, text, row[0], target_group_id, row[4]))
+
     def create_product(self, product_data: dict, target_group_id: Optional[str] = None) -> int:
         """Создание нового продукта. Если указан target_group_id, добавляет товар в существующую группу.
 
-        Иначе создаёт новую группу вида manual_{product_id} через _auto_assign_group.
+        Иначе товар привязывается к ближайшей группе по ANN-индексу
+        (_auto_assign_group), а без подходящей — к новой группе manual_{product_id}.
         """
+        text = product_text(product_data.get('name'), product_data.get('model'), product_data.get('manufacturer'))
+        category = product_data.get('category_name') or ''
         try:
-            self.cursor.execute('''
-            INSERT INTO products 
-            (original_id, name, model, manufacturer, country, category_id, category_name, image_url, characteristics)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                product_data.get('original_id', ''),
-                product_data.get('name', ''),
-                product_data.get('model', ''),
-                product_data.get('manufacturer', ''),
-                product_data.get('country', ''),
-                product_data.get('category_id', ''),
-                product_data.get('category_name', ''),
-                product_data.get('image_url', ''),
-                product_data.get('characteristics', '')
-            ))
-            new_id = self.cursor.lastrowid
-            self.conn.commit()
-
-            if target_group_id:
-                # Проверяем, что группа существует
-                grp = self.cursor.execute('SELECT group_id, product_count FROM groups WHERE group_id = ?', (target_group_id,)).fetchone()
-                if not grp:
-                    raise ValueError(f"Group '{target_group_id}' not found")
-
-                # Привязываем товар к группе
-                self.cursor.execute('UPDATE products SET group_id = ? WHERE id = ?', (target_group_id, new_id))
-                # Обновляем счётчик товаров группы
-                self.cursor.execute('UPDATE groups SET product_count = COALESCE(product_count, 0) + 1 WHERE group_id = ?', (target_group_id,))
-                self.conn.commit()
-            else:
-                # Автоматическое определение/создание группы
-                self._auto_assign_group(new_id)
+            # Поиск до транзакции: первое построение индекса не держит блокировку записи
+            match = None if target_group_id else self.group_index().search(text, category)
+            with self.pool.transaction() as conn:
+                cursor = conn.execute('''
+                INSERT INTO products 
+                (original_id, name, model, manufacturer, country, category_id, category_name, image_url, characteristics)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    product_data.get('original_id', ''),
+                    product_data.get('name', ''),
+                    product_data.get('model', ''),
+                    product_data.get('manufacturer', ''),
+                    product_data.get('country', ''),
+                    product_data.get('category_id', ''),
+                    product_data.get('category_name', ''),
+                    product_data.get('image_url', ''),
+                    product_data.get('characteristics', '')
+                ))
+                new_id = cursor.lastrowid
+                conn.executemany(INSERT_ATTRIBUTES_SQL, attribute_rows(new_id, product_data.get('characteristics', '')))
+
+                if target_group_id:
+                    # Проверяем, что группа существует
+                    grp = conn.execute('SELECT group_id, product_count FROM groups WHERE group_id = ?', (target_group_id,)).fetchone()
+                    if not grp:
+                        raise ValueError(f"Group '{target_group_id}' not found")
+
+                    # Привязываем товар к группе
+                    conn.execute('UPDATE products SET group_id = ? WHERE id = ?', (target_group_id, new_id))
+                    # Обновляем счётчик товаров группы
+                    conn.execute('UPDATE groups SET product_count = COALESCE(product_count, 0) + 1 WHERE group_id = ?', (target_group_id,))
+                    group_id = target_group_id
+                else:
+                    # Автоматическое определение/создание группы
+                    group_id = self._auto_assign_group(conn, new_id, match)
 
+                self._adjust_facets(conn, 'SELECT ?', (new_id,), 1)
+
+            if group_id:
+                self.group_index().add(text, group_id, category)
+                self.group_cache.invalidate(group_id)
             return new_id
         except Exception as e:
             logger.error(f"Error creating product: {e}")
             raise
 
-    def _auto_assign_group(self, product_id: int):
-        """Автоматическое назначение группы для продукта"""
+    def _auto_assign_group(self, conn: sqlite3.Connection, product_id: int,
+                           match: Optional[tuple] = None) -> Optional[str]:
+        """Автоматическое назначение группы для продукта (в транзакции вызывающего).
+
+        match — результат GroupIndex.search: группа и косинус с её центроидом.
+        При косинусе не ниже GROUP_INDEX_THRESHOLD товар добавляется в эту
+        группу (если её не удалили), иначе создаётся manual_{product_id}.
+        Возвращает id группы.
+        """
         try:
-            # Получаем все группы и их продукты для сравнения
-            all_groups = self.cursor.execute('SELECT group_id FROM groups').fetchall()
-            product = self.cursor.execute('SELECT * FROM products WHERE id = ?', (product_id,)).fetchone()
+            product = conn.execute('SELECT * FROM products WHERE id = ?', (product_id,)).fetchone()
             
             if not product:
-                return
-                
-            # Простая логика сопоставления - в реальности нужно использовать grouping_core
-            # Временная заглушка - создаем новую группу
+                return None
+
+            if match is not None and match[1] >= GROUP_INDEX_THRESHOLD:
+                updated = conn.execute(
+                    'UPDATE groups SET product_count = COALESCE(product_count, 0) + 1 WHERE group_id = ?',
+                    (match[0],)
+                ).rowcount
+                if updated:
+                    conn.execute('UPDATE products SET group_id = ? WHERE id = ?', (match[0], product_id))
+                    return match[0]
+
             new_group_id = f"manual_{product_id}"
-            self.cursor.execute(
+            conn.execute(
                 'INSERT INTO groups (group_id, name, representative_id, product_count) VALUES (?, ?, ?, 1)',
                 (new_group_id, product[2], product_id)  # product[2] - name
             )
-            self.cursor.execute(
+            conn.execute(
                 'UPDATE products SET group_id = ? WHERE id = ?',
                 (new_group_id, product_id)
             )
-            self.conn.commit()
+            return new_group_id
             
         except Exception as e:
             logger.error(f"Error auto-assigning group: {e}")
+            return None
 
     def update_product(self, product_id: int, product_data: dict):
         """Обновление продукта"""
         try:
-            self.cursor.execute('''
-            UPDATE products SET 
-            name=?, model=?, manufacturer=?, country=?, category_id=?, category_name=?, image_url=?, characteristics=?
-            WHERE id=?
-            ''', (
-                product_data.get('name'),
-                product_data.get('model'),
-                product_data.get('manufacturer'),
-                product_data.get('country'),
-                product_data.get('category_id'),
-                product_data.get('category_name'),
-                product_data.get('image_url'),
-                product_data.get('characteristics'),
-                product_id
-            ))
-            self.conn.commit()
+            with self.pool.transaction() as conn, self._facets_tracked(conn, 'SELECT ?', (product_id,)):
+                old = conn.execute(
+                    'SELECT group_id, name, model, manufacturer FROM products WHERE id = ?', (product_id,)
+                ).fetchone()
+                conn.execute('''
+                UPDATE products SET 
+                name=?, model=?, manufacturer=?, country=?, category_id=?, category_name=?, image_url=?, characteristics=?
+                WHERE id=?
+                ''', (
+                    product_data.get('name'),
+                    product_data.get('model'),
+                    product_data.get('manufacturer'),
+                    product_data.get('country'),
+                    product_data.get('category_id'),
+                    product_data.get('category_name'),
+                    product_data.get('image_url'),
+                    product_data.get('characteristics'),
+                    product_id
+                ))
+                conn.execute('DELETE FROM product_attributes WHERE product_id = ?', (product_id,))
+                conn.executemany(INSERT_ATTRIBUTES_SQL, attribute_rows(product_id, product_data.get('characteristics')))
+            self.product_cache.invalidate(product_id)
+            if old and old[0]:
+                # Центроид группы: старый текст товара заменяется новым
+                old_text = product_text(*old[1:])
+                new_text = product_text(product_data.get('name'), product_data.get('model'),
+                                        product_data.get('manufacturer'))
+                self._update_group_index(lambda index: _move_in_index(index, old_text, old[0], old[0], new_text=new_text))
         except Exception as e:
             logger.error(f"Error updating product {product_id}: {e}")
             raise
@@ -392,29 +942,157 @@ class Storage:
     def delete_product(self, product_id: int):
         """Удаление продукта"""
         try:
-            # Получаем группу продукта
-            group_row = self.cursor.execute(
-                'SELECT group_id FROM products WHERE id = ?', (product_id,)
-            ).fetchone()
-            
-            self.cursor.execute('DELETE FROM products WHERE id = ?', (product_id,))
-            
-            # Обновляем счетчик группы
+            with self.pool.transaction() as conn, self._facets_tracked(conn, 'SELECT ?', (product_id,)):
+                # Получаем группу продукта
+                group_row = conn.execute(
+                    'SELECT group_id, name, model, manufacturer FROM products WHERE id = ?', (product_id,)
+                ).fetchone()
+
+                conn.execute('DELETE FROM products WHERE id = ?', (product_id,))
+
+                # Обновляем счетчик группы
+                if group_row and group_row[0]:
+                    conn.execute(
+                        'UPDATE groups SET product_count = product_count - 1 WHERE group_id = ?',
+                        (group_row[0],)
+                    )
+            self.product_cache.invalidate(product_id)
             if group_row and group_row[0]:
-                self.cursor.execute(
-                    'UPDATE groups SET product_count = product_count - 1 WHERE group_id = ?',
-                    (group_row[0],)
-                )
-                
-            self.conn.commit()
+                self.group_cache.invalidate(group_row[0])
+                text = product_text(*group_row[1:])
+                self._update_group_index(lambda index: index.subtract(text, group_row[0]))
         except Exception as e:
             logger.error(f"Error deleting product {product_id}: {e}")
             raise
 
+    @contextmanager
+    def catalog_replacement(self):
+        """Атомарная замена каталога при потоковой загрузке.
+
+        Товары, добавленные внутри блока (add_products с replace=False),
+        дописываются к старому каталогу. Старый каталог с группами удаляется
+        одной транзакцией только после успешного выхода из блока; при ошибке
+        удаляются новые товары и каталог остаётся прежним.
+        Внутри блока new_upload_rows отмечает строки файла, встреченные впервые.
+        """
+        # AUTOINCREMENT: id новых товаров всегда больше текущего максимума
+        with self.pool.transaction() as conn:
+            boundary = conn.execute('SELECT COALESCE(MAX(id), 0) FROM products').fetchone()[0]
+            conn.execute('DELETE FROM upload_row_hashes')
+        try:
+            yield
+        except BaseException:
+            with self.pool.transaction() as conn:
+                conn.execute('DELETE FROM products WHERE id > ?', (boundary,))
+                conn.execute('DELETE FROM upload_row_hashes')
+            self._invalidate_all()
+            raise
+        with self.pool.transaction() as conn:
+            conn.execute('DELETE FROM products WHERE id <= ?', (boundary,))
+            # Новые товары ещё без групп: все группы и фасеты — от старого каталога
+            conn.execute('DELETE FROM groups')
+            conn.execute('DELETE FROM facet_counts')
+            conn.execute('DELETE FROM upload_row_hashes')
+        self._invalidate_all()
+
+    def new_upload_rows(self, hashes: np.ndarray) -> np.ndarray:
+        """Маска строк чанка, чьих хешей (uint64) ещё не было в текущей загрузке.
+
+        Хеши копятся в upload_row_hashes, поэтому память процесса не растёт
+        с размером файла. Повторы внутри чанка маской не отсекаются — их
+        удаляет preprocess_and_normalize.
+        """
+        # INTEGER в SQLite знаковый: те же 64 бита как int64
+        signed = np.asarray(hashes, dtype=np.uint64).view(np.int64).tolist()
+        with self.pool.transaction() as conn:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS chunk_hashes (position INTEGER PRIMARY KEY, hash INTEGER)')
+            conn.execute('DELETE FROM temp.chunk_hashes')
+            conn.executemany('INSERT INTO temp.chunk_hashes (position, hash) VALUES (?, ?)', enumerate(signed))
+            seen = [row[0] for row in conn.execute(
+                'SELECT position FROM temp.chunk_hashes JOIN upload_row_hashes u ON u.hash = chunk_hashes.hash'
+            )]
+            conn.execute('INSERT OR IGNORE INTO upload_row_hashes (hash) SELECT hash FROM temp.chunk_hashes')
+            conn.execute('DELETE FROM temp.chunk_hashes')
+        mask = np.ones(len(signed), dtype=bool)
+        mask[seen] = False
+        return mask
+
     def clear(self):
         """Очистка всех данных"""
-        self.cursor.execute('DELETE FROM products')
-        self.cursor.execute('DELETE FROM groups')
-        self.conn.commit()
+        with self.pool.transaction() as conn:
+            conn.execute('DELETE FROM products')
+            conn.execute('DELETE FROM groups')
+            conn.execute('DELETE FROM facet_counts')
+            conn.execute('DELETE FROM product_signatures')
+        self._invalidate_all()
+
+
+def _reindex_products(index: GroupIndex, rows: List[tuple], targets: Dict[int, str],
+                      removed: Sequence[str] = ()):
+    """Перенос товаров в индексе групп после массовой записи.
+
+    rows — снимок _index_rows до записи, targets — id товара -> новая группа
+    (товара нет в targets — он остался без группы), removed — удалённые группы.
+    """
+    for group_id in removed:
+        index.remove(group_id)
+    removed = set(removed)
+    for product_id, text, category, source in rows:
+        if source and source not in removed:
+            index.subtract(text, source)
+        if product_id in targets:
+            index.add(text, targets[product_id], category)
+
+
+def _move_in_index(index: GroupIndex, text: str, source: Optional[str], target: str,
+                   category: Optional[str] = None, new_text: Optional[str] = None):
+    """Перенос товара между центроидами индекса групп (source — None, если товар был без группы)"""
+    if source:
+        index.subtract(text, source)
+    index.add(new_text if new_text is not None else text, target, category or '')
+
+
+def _characteristics_dict(raw: Optional[str]) -> Dict[str, str]:
+    """Характеристики "ключ: значение; ..." в словарь (ключи как в исходных данных)"""
+    characteristics = {}
+    if raw:
+        for part in raw.split(';'):
+            if ':' in part:
+                key, value = part.split(':', 1)
+                characteristics[key.strip()] = value.strip()
+    return characteristics
+
+
+def _fts_query(text: str) -> Optional[str]:
+    """Строка запроса FTS5: каждое слово ищется по префиксу, слова объединяются через AND"""
+    tokens = re.findall(r'\w+', text.lower().replace('ё', 'е'))
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def _encode_cursor(*position) -> str:
+    """Непрозрачный курсор keyset-пагинации: ([rank,] product_count, group_id)"""
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def _decode_cursor(cursor: str, ranked: bool) -> list:
+    """Позиция из курсора; ranked — страница с полнотекстовым поиском (в позиции есть rank)"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as exc:
+        raise ValueError(f"Invalid cursor: {cursor}") from exc
+    if not isinstance(position, list) or len(position) != (3 if ranked else 2):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return position
+
+
+def _fetch_dict(cursor: sqlite3.Cursor) -> Optional[Dict]:
+    """Первая строка курсора как dict (описание колонок берётся с того же курсора)"""
+    row = cursor.fetchone()
+    if not row:
+        return None
+    columns = [desc[0] for desc in cursor.description]
+    return dict(zip(columns, row))
 
 storage = Storage()
\ No newline at end of file
@@ -0,0 +1,49 @@
+# backend/benchmarks/bench_signatures.py
+"""Сравнение построчного и поколоночного построения сигнатур.
+
+Запуск из backend/: python -m benchmarks.bench_signatures [rows]
+"""
+import random
+import sys
+import time
+
+import pandas as pd
+
+from app.services.grouping_core import ProductGrouper
+
+NAMES = ['Ручка шариковая', 'Шина летняя', 'Бумага офисная A4', 'Кабель USB-C', 'Лампа светодиодная']
+BRANDS = ['Pilot', 'BIC', 'Michelin', 'Hankook', 'Gauss', '']
+CHARACTERISTICS = ['Цвет: синий', 'Цвет: красный', 'Размер: 42', 'Тип: гелевая', 'Модель: X-1',
+                   'Вес = 1,5 кг', 'Материал - пластик', 'Длина: 1 м']
+
+
+def make_catalog(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = random.Random(seed)
+    return pd.DataFrame({
+        'название сте': [f'{rng.choice(NAMES)} {rng.randint(1, 5000)}' for _ in range(rows)],
+        'модель': [f'M-{rng.randint(1, 20000)}' for _ in range(rows)],
+        'производитель': [rng.choice(BRANDS) for _ in range(rows)],
+        'название категории': [rng.choice(NAMES).split()[0] for _ in range(rows)],
+        'характеристики': [';'.join(rng.sample(CHARACTERISTICS, rng.randint(0, 5))) for _ in range(rows)],
+    })
+
+
+def main(rows: int) -> None:
+    df = make_catalog(rows)
+    grouper = ProductGrouper()
+
+    started = time.perf_counter()
+    expected = [grouper.build_product_signature(grouper.extract_key_features(row)) for _, row in df.iterrows()]
+    iterrows_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    signatures = grouper.build_signatures(df)['signature'].tolist()
+    vectorized_time = time.perf_counter() - started
+
+    assert signatures == expected, 'signatures differ'
+    print(f'{rows} rows: iterrows {iterrows_time:.2f}s, vectorized {vectorized_time:.2f}s, '
+          f'speedup x{iterrows_time / vectorized_time:.1f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,41 @@
+# backend/benchmarks/bench_startup.py
+"""Время старта приложения: импорт в чистом интерпретаторе и тяжёлые модули, попавшие в sys.modules.
+
+Запуск из backend/: python -m benchmarks.bench_startup [module] [runs]
+module — что импортировать (по умолчанию app.main, его грузит uvicorn;
+main — точка входа backend/main.py, требует uvicorn).
+"""
+import json
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ['pandas', 'numpy', 'scipy', 'sklearn', 'rapidfuzz', 'jellyfish', 'torch', 'sentence_transformers']
+
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def measure(module: str) -> dict:
+    probe = PROBE.format(module=module, heavy=HEAVY_MODULES)
+    output = subprocess.run(
+        [sys.executable, '-c', probe], check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(module: str = 'app.main', runs: int = 5):
+    results = [measure(module) for _ in range(runs)]
+    seconds = [r['seconds'] for r in results]
+    print(f"import {module}: median {statistics.median(seconds):.2f}s, "
+          f"min {min(seconds):.2f}s, max {max(seconds):.2f}s ({runs} runs)")
+    print(f"heavy modules loaded: {', '.join(results[-1]['loaded']) or 'none'}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else 'app.main', int(sys.argv[2]) if len(sys.argv) > 2 else 5)
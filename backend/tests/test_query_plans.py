@@ -0,0 +1,180 @@
+"""Query plans of the SQL that Storage actually runs on hot paths.
+
+Every statement executed by a Storage call is captured with a trace callback
+and run through EXPLAIN QUERY PLAN; the test fails if any step reads a table
+in full, either directly or by walking a whole index.
+
+Run from backend/: python -m pytest tests
+"""
+import re
+from contextlib import contextmanager
+from typing import List
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.storage import Storage
+
+CATEGORIES = ['Ручки', 'Карандаши', 'Бумага', 'Папки']
+MANUFACTURERS = ['Erich Krause', 'BIC', 'Pilot']
+
+# Full passes that are bounded or designed in, with the reason
+ALLOWED_SCANS = {
+    # First page without a cursor: the ordered index walk stops after LIMIT rows
+    'SCAN g USING INDEX idx_groups_product_count': 'LIMIT',
+    # Unfiltered facets aggregate the materialized facet_counts table by design
+    'SCAN facet_counts': None,
+}
+
+# FTS5 encodes a MATCH constraint as "M" in idxStr; without it the virtual table is read in full
+_fts_match_re = re.compile(r'^SCAN \S+ VIRTUAL TABLE INDEX \d+:M')
+_intermediate_re = re.compile(r'^(?:MATERIALIZE|CO-ROUTINE) (.+)$')
+_scan_re = re.compile(r'^SCAN (\S+(?: \(.*?\))?)')
+
+
+def full_scans(conn, sql: str) -> List[str]:
+    """Plan steps of sql that read a whole table or index"""
+    plan = [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+    # CTE and subquery results are already-filtered rows, temp tables hold ids passed by the caller
+    intermediate = {m.group(1) for m in map(_intermediate_re.match, plan) if m}
+    for (name,) in conn.execute("SELECT name FROM temp.sqlite_master WHERE type = 'table'"):
+        intermediate.update((name, f'temp.{name}'))
+    scans = []
+    for detail in plan:
+        match = _scan_re.match(detail)
+        if not match or match.group(1) in intermediate or detail == 'SCAN CONSTANT ROW':
+            continue
+        if _fts_match_re.match(detail):
+            continue
+        if detail in ALLOWED_SCANS and (ALLOWED_SCANS[detail] is None or ALLOWED_SCANS[detail] in sql):
+            continue
+        scans.append(detail)
+    return scans
+
+
+@pytest.fixture
+def storage(tmp_path):
+    # One pooled connection: every statement goes through the traced connection
+    storage = Storage(tmp_path / 'catalog.db', pool_size=1)
+    rows = [{
+        'id сте': str(i),
+        'название сте': f'Ручка шариковая {i % 50}',
+        'модель': f'M{i % 7}',
+        'производитель': MANUFACTURERS[i % 3],
+        'страна происхождения': 'Россия',
+        'id категории': str(i % 4),
+        'название категории': CATEGORIES[i % 4],
+        'ссылка на картинку сте': '',
+        'характеристики': f'Цвет: синий; Длина: {i % 5} см',
+    } for i in range(400)]
+    ids = storage.add_products(pd.DataFrame(rows))
+    storage.apply_groups({f'grp_{k}': list(range(4 * k, 4 * k + 4)) for k in range(100)}, ids)
+    # Wait for the background group index build: it would share the traced connection
+    storage.group_index()
+    return storage
+
+
+@contextmanager
+def traced(storage: Storage):
+    """Statements executed inside the block (with bound parameters inlined)"""
+    statements: List[str] = []
+    with storage.connection() as conn:
+        conn.set_trace_callback(statements.append)
+    try:
+        yield statements
+    finally:
+        with storage.connection() as conn:
+            conn.set_trace_callback(None)
+
+
+def assert_no_full_scans(storage: Storage, statements: List[str]):
+    checked = [sql for sql in statements if re.match(r'\s*(SELECT|WITH|UPDATE|DELETE|INSERT)', sql, re.I)]
+    assert checked, 'nothing was captured'
+    with storage.connection() as conn:
+        failures = {sql: scans for sql in checked if (scans := full_scans(conn, sql))}
+    assert not failures, '\n\n'.join(f'{sql}\n  -> {scans}' for sql, scans in failures.items())
+
+
+SEARCHES = {
+    'first page': dict(),
+    'category': dict(category='Ручки'),
+    'query': dict(query='ручка шарик'),
+    'query and category': dict(query='ручка', category='Папки'),
+    'manufacturer': dict(filters={'manufacturer': 'BIC'}),
+    'category filter': dict(filters={'category_name': 'Бумага'}),
+    'name': dict(filters={'name': 'шарик'}),
+    'model': dict(filters={'model': 'M3'}),
+    'attribute': dict(filters={'Длина': '3 см'}),
+    'product count': dict(filters={'product_count': 4}),
+}
+
+
+@pytest.mark.parametrize('kwargs', SEARCHES.values(), ids=SEARCHES.keys())
+def test_search_groups(storage, kwargs):
+    first = storage.search_groups(**kwargs, limit=5)
+    assert first
+    with traced(storage) as statements:
+        storage.search_groups(**kwargs, limit=5)
+        # Next page by the keyset cursor
+        storage.search_groups(**kwargs, limit=5, after=first[-1]['cursor'])
+    assert_no_full_scans(storage, statements)
+
+
+@pytest.mark.parametrize('kwargs', [dict(), dict(category='Ручки'), dict(query='ручка', category='Ручки')],
+                         ids=['all', 'category', 'query'])
+def test_facets(storage, kwargs):
+    with traced(storage) as statements:
+        storage.get_facets(**kwargs)
+    assert_no_full_scans(storage, statements)
+
+
+def test_group_and_product_reads(storage):
+    with traced(storage) as statements:
+        storage.get_group('grp_3')
+        storage.get_product(5)
+        storage.get_products_df([1, 2, 3, 50])
+        storage.get_low_rated_group_ids()
+        storage.get_protected_group_ids()
+        # Incremental reaggregate reads only the blocks of the affected groups
+        storage.get_category_names()
+        storage.get_category_names(['grp_1', 'grp_2'])
+        storage.get_category_products_df(['Ручки', None])
+        storage.get_group_products_df(['grp_1', 'grp_2'])
+    assert_no_full_scans(storage, statements)
+
+
+def test_slice_signatures(storage):
+    storage.ensure_signatures(storage.get_all_products_df())
+    df = storage.get_products_df(list(range(1, 51)))
+    with traced(storage) as statements:
+        storage.ensure_signatures(df)
+    assert_no_full_scans(storage, statements)
+
+
+def test_single_product_writes(storage):
+    with traced(storage) as statements:
+        storage.move_product_to_group(1, 'grp_7')
+        storage.update_product(2, {'name': 'Ручка гелевая', 'category_name': 'Ручки', 'characteristics': 'Цвет: красный'})
+        storage.rate_group('grp_8', 5)
+        storage.delete_product(3)
+        storage.delete_group('grp_9')
+        storage.ungroup_products([40, 41])
+    assert_no_full_scans(storage, statements)
+
+
+def test_upload_duplicate_lookup(storage):
+    hashes = np.arange(1000, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    with storage.catalog_replacement():
+        storage.new_upload_rows(hashes[:600])
+        with traced(storage) as statements:
+            fresh = storage.new_upload_rows(hashes[400:])
+    assert fresh.tolist() == [False] * 200 + [True] * 400
+    assert_no_full_scans(storage, statements)
+
+
+def test_full_scan_is_detected(storage):
+    with storage.connection() as conn:
+        assert full_scans(conn, "SELECT id FROM products WHERE category_name LIKE '%уч%'")
+        assert full_scans(conn, "SELECT id FROM products ORDER BY group_id")
+        assert not full_scans(conn, "SELECT id FROM products WHERE group_id = 'grp_1'")
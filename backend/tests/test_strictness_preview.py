@@ -0,0 +1,57 @@
+"""Strictness preview against a real hierarchical regroup at the same strictness.
+
+Run from backend/: python -m pytest tests
+"""
+import random
+
+import pandas as pd
+import pytest
+
+from app.services import grouping_core
+from app.services.grouping_core import ProductGrouper, aggregate_df
+
+STRICTNESS = [0.0, 0.3, 0.5, 0.7, 0.9, 1.0]
+
+
+@pytest.fixture(autouse=True)
+def tfidf_cache(tmp_path, monkeypatch):
+    # Block trees and TF-IDF matrices are cached on disk; keep them out of data/
+    monkeypatch.setattr(grouping_core, 'TFIDF_CACHE_DIR', tmp_path / 'tfidf')
+
+
+@pytest.fixture
+def catalog():
+    rng = random.Random(0)
+    names = ['Ручка шариковая', 'Ручка гелевая', 'Карандаш чернографитный', 'Бумага офисная A4']
+    colours = ['синий', 'красный', 'чёрный']
+    return pd.DataFrame({
+        'name': [f'{rng.choice(names)} {rng.choice(colours)} {rng.randint(1, 40)}' for _ in range(300)],
+        'model': [f'M-{rng.randint(1, 60)}' for _ in range(300)],
+        'manufacturer': [rng.choice(['Pilot', 'BIC', 'Erich Krause']) for _ in range(300)],
+        'category_name': [rng.choice(['Ручки', 'Бумага']) for _ in range(300)],
+        'characteristics': [f'Цвет: {rng.choice(colours)}' for _ in range(300)],
+    })
+
+
+def regroup_counts(groups):
+    grouped = [ids for ids in groups.values() if len(ids) > 1]
+    return len(grouped), sum(map(len, grouped))
+
+
+@pytest.mark.parametrize('min_member_similarity', [None, 0.8], ids=['plain', 'verified'])
+def test_preview_matches_regroup(catalog, min_member_similarity):
+    grouper = ProductGrouper(hierarchical=True, min_member_similarity=min_member_similarity)
+    features = grouper.build_signatures(catalog)
+    preview = grouper.strictness_preview(catalog, STRICTNESS, features=features)
+    for row in preview:
+        groups = aggregate_df(catalog, strictness=row['strictness'], hierarchical=True,
+                              min_member_similarity=min_member_similarity, features=features)
+        assert (row['groups'], row['grouped_products']) == regroup_counts(groups), row['strictness']
+        assert row['singles'] == len(catalog) - row['grouped_products']
+
+
+def test_verification_changes_preview(catalog):
+    # The parametrized test above only means something if verification splits members here
+    plain = ProductGrouper(hierarchical=True).strictness_preview(catalog, STRICTNESS)
+    verified = ProductGrouper(hierarchical=True, min_member_similarity=0.8).strictness_preview(catalog, STRICTNESS)
+    assert any(a['grouped_products'] > b['grouped_products'] for a, b in zip(plain, verified))
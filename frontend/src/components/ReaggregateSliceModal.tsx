@@ -1,10 +1,20 @@
 // frontend/src/components/ReaggregateSliceModal.tsx
 import { Button } from '@/components/ui/button';
 import { Dialog, DialogContent, DialogHeader, DialogTitle } from '@/components/ui/dialog';
-import { useState } from 'react';
+import { useEffect, useState } from 'react';
 import axios from 'axios';
 import { PATHS } from '@/config/paths';
 
+interface StrictnessPreview {
+    strictness: number;
+    groups: number;
+    grouped_products: number;
+    singles: number;
+}
+
+// Шаг ползунка, для которого заранее считаем число групп
+const PREVIEW_VALUES = Array.from({ length: 21 }, (_, i) => i / 20);
+
 interface Props {
     open: boolean;
     onOpenChange: (v: boolean) => void;
@@ -14,10 +24,33 @@ interface Props {
 export function ReaggregateSliceModal({ open, onOpenChange, selectedProductIds }: Props) {
     const [strictness, setStrictness] = useState(0.7);
     const [loading, setLoading] = useState(false);
+    const [preview, setPreview] = useState<StrictnessPreview[]>([]);
+
+    // Разрезы дерева дешёвые: одним запросом получаем число групп для всего диапазона
+    useEffect(() => {
+        if (!open || selectedProductIds.length === 0) return;
+        axios
+            .post<StrictnessPreview[]>(
+                PATHS.groups.strictnessPreview,
+                { product_ids: selectedProductIds },
+                { params: { values: PREVIEW_VALUES }, paramsSerializer: { indexes: null } },
+            )
+            .then(res => setPreview(res.data))
+            .catch(() => setPreview([]));
+    }, [open, selectedProductIds]);
+
+    const nearest = preview.reduce<StrictnessPreview | undefined>(
+        (best, p) => (!best || Math.abs(p.strictness - strictness) < Math.abs(best.strictness - strictness) ? p : best),
+        undefined,
+    );
 
     const handle = async () => {
         setLoading(true);
-        await axios.post(PATHS.groups.reaggregateSlice, { product_ids: selectedProductIds }, { params: { strictness } });
+        await axios.post(
+            PATHS.groups.reaggregateSlice,
+            { product_ids: selectedProductIds },
+            { params: { strictness, hierarchical: true } },
+        );
         setLoading(false);
         onOpenChange(false);
         window.location.reload(); // или обнови через store
@@ -40,6 +73,11 @@ export function ReaggregateSliceModal({ open, onOpenChange, selectedProductIds }
                             className="w-full"
                         />
                         <span>{(strictness * 100).toFixed(0)}%</span>
+                        {nearest && (
+                            <p className="text-sm text-muted-foreground">
+                                ≈ {nearest.groups} групп, {nearest.singles} товаров без группы
+                            </p>
+                        )}
                     </div>
                     <Button onClick={handle} disabled={loading}>
                         {loading ? 'Обработка...' : 'Переагрегировать пул'}
@@ -14,6 +14,10 @@ export function Filters() {
     const fetchGroups = useProductsStore((s) => s.fetchGroups);
     const reaggregate = useProductsStore((s) => s.reaggregate);
     const storeQuery = useProductsStore((s) => s.query);
+    const category = useProductsStore((s) => s.category);
+    const setCategory = useProductsStore((s) => s.setCategory);
+    const facets = useProductsStore((s) => s.facets);
+    const fetchFacets = useProductsStore((s) => s.fetchFacets);
     const [localQuery, setLocalQuery] = React.useState(storeQuery);
     const [strictness, setStrictness] = React.useState(0.7);
 
@@ -27,6 +31,16 @@ export function Filters() {
         return () => clearTimeout(id);
     }, [localQuery, storeQuery, setQuery, fetchGroups]);
 
+    // Счётчики фасетов пересчитываются под текущие запрос и категорию
+    React.useEffect(() => {
+        void fetchFacets();
+    }, [storeQuery, category, fetchFacets]);
+
+    const toggleCategory = (value: string) => {
+        setCategory(category === value ? '' : value);
+        void fetchGroups(true);
+    };
+
     return (
         <Accordion type="single" collapsible className="w-full">
             <AccordionItem value="search">
@@ -38,8 +52,42 @@ export function Filters() {
                         placeholder="Название, модель..."
                         className="w-full rounded-md border px-3 py-2 text-sm mb-2"
                     />
-                    {/* Добавь другие фильтры по ТЗ, e.g. category */}
-                    <Button variant="outline" onClick={() => setLocalQuery('')}>
+                    {facets && facets.categories.length > 0 && (
+                        <div className="mb-2 space-y-1">
+                            <div className="text-xs text-black/60">Категории</div>
+                            {facets.categories.map((f) => (
+                                <button
+                                    key={f.value}
+                                    type="button"
+                                    onClick={() => toggleCategory(f.value)}
+                                    className={`flex w-full justify-between rounded px-2 py-1 text-left text-sm ${
+                                        category === f.value ? 'bg-black/10 font-medium' : 'hover:bg-black/5'
+                                    }`}
+                                >
+                                    <span className="truncate">{f.value || '—'}</span>
+                                    <span className="text-black/60">{f.count}</span>
+                                </button>
+                            ))}
+                        </div>
+                    )}
+                    {facets && facets.manufacturers.length > 0 && (
+                        <div className="mb-2 space-y-1">
+                            <div className="text-xs text-black/60">Производители</div>
+                            {facets.manufacturers.map((f) => (
+                                <div key={f.value} className="flex justify-between px-2 text-sm">
+                                    <span className="truncate">{f.value || '—'}</span>
+                                    <span className="text-black/60">{f.count}</span>
+                                </div>
+                            ))}
+                        </div>
+                    )}
+                    <Button
+                        variant="outline"
+                        onClick={() => {
+                            setLocalQuery('');
+                            if (category) toggleCategory(category);
+                        }}
+                    >
                         Сбросить
                     </Button>
                 </AccordionContent>
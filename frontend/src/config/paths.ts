@@ -13,7 +13,9 @@ export const PATHS = {
         aggregate: `${API_BASE}/groups/aggregate`,
         reaggregate: `${API_BASE}/groups/reaggregate`,
         reaggregateSlice: `${API_BASE}/groups/reaggregate-slice`,
+        strictnessPreview: `${API_BASE}/groups/strictness-preview`,
         list: `${API_BASE}/groups`,
+        facets: `${API_BASE}/groups/facets`,
         get: (id: string) => `${API_BASE}/groups/${id}`,
         rate: (id: string) => `${API_BASE}/groups/${id}/rate`,
         delete: (id: string) => `${API_BASE}/groups/${id}`,
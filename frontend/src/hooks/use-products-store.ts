@@ -16,14 +16,25 @@ type Group = {
   products?: any[];
 };
 
+type FacetValue = { value: string; count: number };
+
+type Facets = {
+  categories: FacetValue[];
+  manufacturers: FacetValue[];
+  attributes: Record<string, FacetValue[]>;
+};
+
 type ProductsState = {
   groups: Group[];
   lastUploadWarnings: string[];
   total: number;
   page: number;
+  nextCursor: string | null;
   pageSize: number;
   loading: boolean;
   query: string;
+  category: string;
+  facets?: Facets;
   currentGroup?: Group;
   uploading: boolean;
   uploadProgress: number;
@@ -33,6 +44,8 @@ type ProductsState = {
   fetchGroup: (id: string) => Promise<Group | undefined>;
   getProduct: (productId: number | string) => Promise<any>;
   setQuery: (q: string) => void;
+  setCategory: (category: string) => void;
+  fetchFacets: () => Promise<void>;
   setViewMode: (mode: 'cards' | 'table') => void;
   upload: (file: File, signal?: AbortSignal) => Promise<void>;
   reaggregate: (strictness: number) => Promise<void>;
@@ -51,21 +64,26 @@ export const useProductsStore = create<ProductsState>((set, get) => ({
   lastUploadWarnings: [],
   total: 0,
   page: 1,
+  nextCursor: null,
   pageSize: 20,
   loading: false,
   query: '',
+  category: '',
+  facets: undefined,
   currentGroup: undefined,
   uploading: false,
   uploadProgress: 0,
   initialized: false,
   viewMode: 'cards',
   async fetchGroups(reset = false) {
-    set({ loading: true, ...(reset ? { page: 1 } : {}) });
-    const { query, pageSize, page } = get();
-    const pageToFetch = reset ? 1 : page;
-    const offset = (pageToFetch - 1) * pageSize;
+    set({ loading: true, ...(reset ? { page: 1, nextCursor: null } : {}) });
+    const { query, category, pageSize, nextCursor } = get();
+    // Keyset-пагинация: следующая страница запрашивается по курсору из X-Next-Cursor
+    const after = reset ? undefined : nextCursor ?? undefined;
     try {
-      const res = await axios.get<any[]>(PATHS.groups.list, { params: { query, offset, limit: pageSize } });
+      const res = await axios.get<any[]>(PATHS.groups.list, {
+        params: { query, category: category || undefined, after, limit: pageSize },
+      });
       // Map backend format to Group
       const data: Group[] = Array.isArray(res.data)
         ? res.data.map((g: any) => ({
@@ -82,9 +100,11 @@ export const useProductsStore = create<ProductsState>((set, get) => ({
         : [];
       const prev = get().groups;
       const merged = reset ? data : [...prev, ...data];
-      const hasMore = data.length >= pageSize;
+      const cursor = (res.headers['x-next-cursor'] as string | undefined) ?? null;
+      const hasMore = cursor !== null;
       set({
         groups: merged,
+        nextCursor: cursor,
         total: hasMore ? merged.length + 1 : merged.length,
         initialized: true,
         loading: false,
@@ -104,6 +124,18 @@ export const useProductsStore = create<ProductsState>((set, get) => ({
     return res.data;
   },
   setQuery: (q: string) => set({ query: q, page: 1 }),
+  setCategory: (category: string) => set({ category, page: 1 }),
+  async fetchFacets() {
+    const { query, category } = get();
+    try {
+      const res = await axios.get<Facets>(PATHS.groups.facets, {
+        params: { query: query || undefined, category: category || undefined },
+      });
+      set({ facets: res.data });
+    } catch (_err) {
+      set({ facets: undefined });
+    }
+  },
   setViewMode: (mode) => set({ viewMode: mode }),
 
   async upload(file: File, signal?: AbortSignal) {